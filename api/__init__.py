@@ -1,29 +1,61 @@
-from flask import Flask
 import os
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from config import config
+from .admission import Admission
+from .cache import IdentityCache
+from .compression import Compress
+from .engine import apply_sqlite_pragmas
+from .json_provider import JSONApp
+from .metrics import Metrics
+from .routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+identity_cache = IdentityCache()
+compress = Compress()
+metrics = Metrics()
+admission = Admission()
+
+# The job queue's models need db, so it is imported once db exists.
+from .jobs import JobQueue
+job_queue = JobQueue()
 
 def create_app(config_name):
-    app = Flask(__name__, static_folder="statics")
+    app = JSONApp(__name__, static_folder="statics")
     app.config.from_object(config[config_name])
 
     config[config_name].init_app(app)
 
     db.init_app(app)
+    with app.app_context():
+        for bind in [None] + app.extensions['replica_router'].binds:
+            engine = db.get_engine(app, bind=bind)
+            apply_sqlite_pragmas(engine, app.config.get('SQLITE_PRAGMAS'))
+            metrics.instrument(engine)
+    admission.init_app(app)
+    metrics.register(admission.render)
+    identity_cache.init_app(app)
+    compress.init_app(app)
+    metrics.init_app(app)
+    job_queue.init_app(app)
     CORS(app)
 
     from .user import user
     from .project import project
     from .task import task
     from .label import label
+    from .admin import admin
+    from .search import search
+    from .sync import sync
+    from .workspace import workspace
 
     app.register_blueprint(user)
     app.register_blueprint(project)
     app.register_blueprint(task)
     app.register_blueprint(label)
+    app.register_blueprint(admin)
+    app.register_blueprint(search)
+    app.register_blueprint(sync)
+    app.register_blueprint(workspace)
     
     @app.route('/welcome')
     def home():
@@ -0,0 +1,27 @@
+import hmac
+from flask import Blueprint, Response, request, current_app, abort
+from . import identity_cache, metrics, job_queue
+from .user import admin_auth_required
+
+
+admin = Blueprint("admin", __name__)
+
+@admin.route('/admin/cache', methods=['GET'])
+@admin_auth_required
+def get_cache_stats(u=None):
+    return {
+        "message": "Cache stats retrieved successfully",
+        "data": {
+            "identity": identity_cache.stats(),
+            "jobs": job_queue.stats()
+        }
+    }, 200
+
+@admin.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Scrapers cannot log in, so /metrics is guarded by a static bearer
+    # token when METRICS_TOKEN is set.
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
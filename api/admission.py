@@ -0,0 +1,135 @@
+import math
+import threading
+import time
+from flask import request, g
+from .routing import READ_METHODS
+
+AUTH_ENDPOINTS = ('user.login', 'user.register')
+
+
+class TokenBucket():
+    """Per-key token buckets refilled at rate tokens per second up to burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Take a token for key; returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            if len(self._buckets) > 10000:
+                # Buckets idle long enough to be full again carry no state.
+                idle = self.burst / self.rate
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < idle}
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+class Admission():
+    """Sheds load before it reaches the database.
+
+    Requests are classed as auth, read or write, and each class may only
+    have ADMISSION_LIMITS[class] requests in flight; past that they get an
+    immediate 503 with Retry-After instead of queueing for a connection.
+    A request stays in flight until its teardown, so a streamed body counts
+    until it is fully sent. With ADMISSION_USER_RATE set, each user also
+    gets a token bucket, charged once auth has resolved them.
+    """
+
+    def __init__(self, app=None):
+        self.limits = {}
+        self.in_flight = {}
+        self.rejected = {}
+        self.throttled = 0
+        self.bucket = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('ADMISSION_ENABLED', True)
+        self.limits = dict(app.config.get('ADMISSION_LIMITS') or {})
+        self.retry_after = app.config.get('ADMISSION_RETRY_AFTER', 1)
+        self.exempt = set(app.config.get('ADMISSION_EXEMPT') or ())
+        self.in_flight = {name: 0 for name in self.limits}
+        self.rejected = {name: 0 for name in self.limits}
+        rate = app.config.get('ADMISSION_USER_RATE')
+        self.bucket = TokenBucket(rate, app.config.get('ADMISSION_USER_BURST', rate)) if rate else None
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    @staticmethod
+    def route_class():
+        if request.endpoint in AUTH_ENDPOINTS:
+            return 'auth'
+        if request.method in READ_METHODS:
+            return 'read'
+        return 'write'
+
+    def before_request(self):
+        if not self.enabled or request.endpoint in self.exempt:
+            return None
+        name = self.route_class()
+        limit = self.limits.get(name)
+        if limit is None:
+            return None
+        with self._lock:
+            if self.in_flight[name] >= limit:
+                self.rejected[name] += 1
+                return {
+                    "message": "Server is busy, try again shortly"
+                }, 503, {"Retry-After": str(self.retry_after)}
+            self.in_flight[name] += 1
+        g.admission_class = name
+        return None
+
+    def teardown_request(self, exc):
+        name = g.pop('admission_class', None)
+        if name is not None:
+            with self._lock:
+                self.in_flight[name] -= 1
+
+    def throttle(self, user_id):
+        """A 429 response if user_id has run out of tokens, else None."""
+        if self.bucket is None:
+            return None
+        wait = self.bucket.take(user_id)
+        if not wait:
+            return None
+        with self._lock:
+            self.throttled += 1
+        return {
+            "message": "Too many requests"
+        }, 429, {"Retry-After": str(max(1, math.ceil(wait)))}
+
+    def render(self):
+        with self._lock:
+            in_flight, rejected, throttled = dict(self.in_flight), dict(self.rejected), self.throttled
+        lines = [
+            '# HELP planner_admission_in_flight Requests currently admitted, by route class.',
+            '# TYPE planner_admission_in_flight gauge'
+        ]
+        lines += ['planner_admission_in_flight{{class="{}"}} {}'.format(name, value) for name, value in sorted(in_flight.items())]
+        lines += [
+            '# HELP planner_admission_limit In-flight limit, by route class.',
+            '# TYPE planner_admission_limit gauge'
+        ]
+        lines += ['planner_admission_limit{{class="{}"}} {}'.format(name, value) for name, value in sorted(self.limits.items())]
+        lines += [
+            '# HELP planner_admission_rejected_total Requests shed with 503, by route class.',
+            '# TYPE planner_admission_rejected_total counter'
+        ]
+        lines += ['planner_admission_rejected_total{{class="{}"}} {}'.format(name, value) for name, value in sorted(rejected.items())]
+        lines += [
+            '# HELP planner_admission_throttled_total Requests refused with 429 by the per-user token bucket.',
+            '# TYPE planner_admission_throttled_total counter',
+            'planner_admission_throttled_total {}'.format(throttled)
+        ]
+        return lines
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdentityCache():
+    """Process-local LRU/TTL cache of resolved identities keyed by token digest."""
+
+    def __init__(self, app=None, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._invalidated = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.get('IDENTITY_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        self.clear()
+
+    @staticmethod
+    def digest(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).hexdigest()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user_id, value, expires = entry
+            if expires <= now:
+                self._discard(key, user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, user_id, value, expires_at=None, loaded_at=None):
+        """Cache value; loaded_at is the monotonic time its lookup began,
+        and a value read before the user was last invalidated is dropped."""
+        if not self.enabled:
+            return
+        expires = time.monotonic() + self.ttl
+        if expires_at is not None:
+            expires = min(expires, time.monotonic() + (expires_at - time.time()))
+        with self._lock:
+            if loaded_at is not None and self._invalidated.get(user_id, float('-inf')) >= loaded_at:
+                return
+            if key in self._entries:
+                self._discard(key, self._entries[key][0])
+            self._entries[key] = (user_id, value, expires)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                old_key, (old_user, _, _) = next(iter(self._entries.items()))
+                self._discard(old_key, old_user)
+
+    def invalidate(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            for key in self._by_user.pop(user_id, ()):
+                self._entries.pop(key, None)
+            if len(self._invalidated) > 10000:
+                # Only lookups still in flight compare against these.
+                self._invalidated = {k: v for k, v in self._invalidated.items() if now - v < self.ttl}
+            self._invalidated[user_id] = now
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._invalidated.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _discard(self, key, user_id):
+        self._entries.pop(key, None)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
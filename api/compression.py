@@ -0,0 +1,97 @@
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _Gzip():
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+class _Brotli():
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+class Compress():
+    """Negotiated gzip/brotli compression of responses.
+
+    Bodies smaller than COMPRESS_MIN_SIZE go out as they are. Streamed
+    responses are compressed chunk by chunk, so they stay streamed.
+    """
+
+    def __init__(self, app=None):
+        self.encoders = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ['application/json']))
+        self.encoders = {'gzip': (_Gzip, app.config.get('COMPRESS_LEVEL', 6))}
+        if brotli is not None:
+            self.encoders['br'] = (_Brotli, app.config.get('COMPRESS_BR_LEVEL', 4))
+        app.after_request(self.after_request)
+
+    def negotiate(self):
+        # Brotli first: on equal q-values the server's preference wins.
+        offered = [name for name in ('br', 'gzip') if name in self.encoders]
+        return request.accept_encodings.best_match(offered)
+
+    def after_request(self, response):
+        if not self.enabled:
+            return response
+        # A 304 carries no body but must repeat the Vary of the 200 it stands for.
+        if response.status_code == 304 or response.mimetype in self.mimetypes:
+            response.vary.add('Accept-Encoding')
+        if (response.mimetype not in self.mimetypes or response.status_code < 200
+                or response.status_code in (204, 304) or 'Content-Encoding' in response.headers):
+            return response
+
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        encoder, level = self.encoders[encoding]
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoder(level), response.charset)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            compressor = encoder(level)
+            response.set_data(compressor.compress(body) + compressor.flush())
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+def _compress_stream(chunks, compressor, charset):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,226 @@
+import datetime
+import json
+import logging
+import threading
+import time
+import traceback
+from flask import current_app
+from sqlalchemy import event, func, or_, and_
+from sqlalchemy.orm import Session
+from . import db
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def job(name):
+    """Register a function as the handler of jobs called name.
+
+    Handlers run in an app context with the job's payload as keyword
+    arguments. A job may run more than once (after a crash or a timeout),
+    so handlers must be idempotent.
+    """
+    def decorator(f):
+        HANDLERS[name] = f
+        return f
+    return decorator
+
+def enqueue(name, max_attempts=None, delay=0, **payload):
+    """Add a job to the current transaction; it becomes visible to the
+    workers when the caller commits."""
+    if name not in HANDLERS:
+        raise KeyError(name)
+    row = Job(
+        name=name,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        run_after=datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+    )
+    db.session.add(row)
+    db.session.info['jobs_enqueued'] = True
+    return row
+
+def _lapsed(now):
+    # Running jobs whose worker let the lease lapse (it crashed or hung).
+    return and_(Job.status == 'running', Job.locked_until < now)
+
+def _ready(now):
+    # Queued jobs that are due, and lapsed ones with attempts left.
+    return or_(
+        and_(Job.status == 'queued', Job.run_after <= now),
+        and_(_lapsed(now), Job.attempts < Job.max_attempts)
+    )
+
+class JobQueue():
+    """Durable job queue on the jobs table, run by a pool of worker threads.
+
+    A worker claims a job by moving it to running with a lease of
+    JOB_VISIBILITY_TIMEOUT seconds; the attempt number it claimed is the
+    lease token, so a worker whose lease was taken over cannot record the
+    outcome. While a job runs, a heartbeat renews the lease, for at most
+    JOB_MAX_RUNTIME seconds. Failures, and leases that lapse, are retried
+    with exponential backoff until max_attempts, then kept as failed for
+    inspection. Finished jobs are deleted.
+    """
+
+    def __init__(self, app=None):
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('JOB_WORKERS', 0) > 0:
+            # Not at import: manager commands build the app too, and must
+            # not start working a queue they may be about to migrate.
+            app.before_first_request(lambda: self.start(app))
+
+    def start(self, app):
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(app.config['JOB_WORKERS']):
+            thread = threading.Thread(target=self._work, args=(app,), name='job-worker-{}'.format(index), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _work(self, app):
+        poll = app.config['JOB_POLL_SECONDS']
+        while not self._stopping.is_set():
+            try:
+                with app.app_context():
+                    ran = self.run_next()
+            except Exception:
+                logger.exception('Job worker failed to poll the queue')
+                ran = False
+            if not ran:
+                self._wakeup.wait(poll)
+                self._wakeup.clear()
+
+    def claim(self):
+        now = datetime.datetime.utcnow()
+        timeout = datetime.timedelta(seconds=current_app.config['JOB_VISIBILITY_TIMEOUT'])
+        # A job that keeps killing or hanging its worker is not reclaimed
+        # after its last attempt. Looked for with a read first, so an idle
+        # poll never takes the write lock.
+        exhausted = and_(_lapsed(now), Job.attempts >= Job.max_attempts)
+        if db.session.query(Job.id).filter(exhausted).first() is not None:
+            db.session.query(Job).filter(exhausted).update({
+                Job.status: 'failed',
+                Job.last_error: 'Lease expired on the last attempt',
+                Job.locked_until: None
+            }, synchronize_session=False)
+            db.session.commit()
+        while True:
+            row = db.session.query(Job.id, Job.attempts).filter(_ready(now)).order_by(Job.run_after, Job.id).first()
+            if row is None:
+                db.session.rollback()
+                return None
+            # Another worker may claim the same row first; the update then
+            # matches nothing and the next candidate is tried.
+            claimed = db.session.query(Job).filter(Job.id == row.id, Job.attempts == row.attempts, _ready(now)).update({
+                Job.status: 'running',
+                Job.attempts: Job.attempts + 1,
+                Job.locked_until: now + timeout
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.query(Job).get(row.id)
+
+    def run_next(self):
+        """Claim and run one job; False when none is ready."""
+        row = self.claim()
+        if row is None:
+            return False
+        # The handler commits and rolls back and the row is updated in
+        # bulk below, so keep plain values rather than the ORM object.
+        id, name, attempts, max_attempts, payload = row.id, row.name, row.attempts, row.max_attempts, row.payload
+        db.session.expunge(row)
+        leased = db.session.query(Job).filter(Job.id == id, Job.attempts == attempts)
+        try:
+            self._run(name, payload, id, attempts)
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            logger.error('Job %s (%s) failed, attempt %s of %s\n%s', id, name, attempts, max_attempts, error)
+            if attempts >= max_attempts:
+                changes = {Job.status: 'failed', Job.last_error: error, Job.locked_until: None}
+            else:
+                delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1)
+                changes = {
+                    Job.status: 'queued', Job.last_error: error, Job.locked_until: None,
+                    Job.run_after: datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+                }
+            leased.update(changes, synchronize_session=False)
+        else:
+            leased.delete(synchronize_session=False)
+        db.session.commit()
+        return True
+
+    def _run(self, name, payload, id, attempts):
+        # The heartbeat is stopped before the outcome is written, so it
+        # never waits on the lock that write takes.
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(current_app._get_current_object(), id, attempts, stop),
+            name='job-heartbeat-{}'.format(id), daemon=True
+        )
+        heartbeat.start()
+        try:
+            HANDLERS[name](**json.loads(payload))
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def _heartbeat(self, app, id, attempts, stop):
+        """Renew the lease of a running job until stop is set or it has run
+        for JOB_MAX_RUNTIME seconds, after which a hung job is reclaimed."""
+        timeout = app.config['JOB_VISIBILITY_TIMEOUT']
+        deadline = time.monotonic() + app.config['JOB_MAX_RUNTIME']
+        while not stop.wait(timeout / 3) and time.monotonic() < deadline:
+            with app.app_context():
+                try:
+                    db.session.query(Job).filter(Job.id == id, Job.attempts == attempts, Job.status == 'running').update({
+                        Job.locked_until: datetime.datetime.utcnow() + datetime.timedelta(seconds=timeout)
+                    }, synchronize_session=False)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Could not renew the lease of job %s', id)
+                finally:
+                    db.session.remove()
+
+    def drain(self):
+        """Run ready jobs in the calling thread until none is left; returns how many ran."""
+        count = 0
+        while self.run_next():
+            count += 1
+        return count
+
+    def stats(self):
+        counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        return {
+            "workers": len(self._threads),
+            "queued": counts.get('queued', 0),
+            "running": counts.get('running', 0),
+            "failed": counts.get('failed', 0)
+        }
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        from . import job_queue
+        job_queue.notify()
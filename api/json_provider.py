@@ -0,0 +1,66 @@
+import datetime
+import json
+from flask import Flask
+from .metrics import timing
+from flask.json import JSONEncoder as BaseJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONEncoder(BaseJSONEncoder):
+    """Flask's encoder, but with ISO-8601 instead of HTTP dates."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+class JSONProvider():
+    """Encodes response bodies, with orjson when it is installed.
+
+    Both encoders produce the same compact output with ISO-8601 datetimes,
+    and keys are sorted when JSON_SORT_KEYS is set, so response bodies do
+    not depend on which one is in use.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.fast = orjson is not None
+
+    def dumps(self, obj):
+        sort_keys = self.app.config['JSON_SORT_KEYS']
+        if self.fast:
+            option = orjson.OPT_NON_STR_KEYS
+            if sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+        return json.dumps(obj, cls=JSONEncoder, sort_keys=sort_keys, ensure_ascii=False, separators=(',', ':'))
+
+    def response(self, obj):
+        return self.app.response_class(self.dumps(obj) + '\n', mimetype=self.app.config['JSONIFY_MIMETYPE'])
+
+def _default(o):
+    # orjson already handles datetimes; fall back to Flask's extras
+    # (UUID, dataclasses, __html__) for anything else.
+    return JSONEncoder().default(o)
+
+class JSONApp(Flask):
+    """Flask app whose dict responses are encoded by a JSONProvider."""
+
+    json_encoder = JSONEncoder
+    json_provider_class = JSONProvider
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.json = self.json_provider_class(self)
+
+    def make_response(self, rv):
+        with timing('serialize'):
+            if isinstance(rv, dict):
+                rv = self.json.response(rv)
+            elif isinstance(rv, tuple) and rv and isinstance(rv[0], dict):
+                rv = (self.json.response(rv[0]),) + rv[1:]
+        return super().make_response(rv)
@@ -1,14 +1,86 @@
 from flask import Blueprint, request, current_app, abort
-from .models import Label
+from .models import Label, Task, TaskLabel, Project, ProjectLabel
+from sqlalchemy import and_, bindparam
 import datetime
 from . import db
 from .user import admin_auth_required, auth_required
+from .versions import versioned, etag_cached
+from .sync import touch
+from .pagination import paginate
+from .streaming import wants_stream, stream_collection
+from .serializers import label_schema
 
 
 label = Blueprint("label", __name__)
 
+def resolve_labels(owner_id, label_ids):
+    """Split label_ids into (owned, invalid) with a single IN query."""
+    wanted = []
+    for label_id in label_ids or []:
+        if isinstance(label_id, int) and label_id not in wanted:
+            wanted.append(label_id)
+    owned = set()
+    if wanted:
+        rows = db.session.query(Label.id).filter(Label.user_id == owner_id, Label.id.in_(wanted))
+        owned = {row.id for row in rows}
+    invalid = [label_id for label_id in label_ids or [] if label_id not in owned]
+    return [label_id for label_id in wanted if label_id in owned], invalid
+
+def link_labels(column, target_id, label_ids, replace=False):
+    """Attach label_ids to a task or project in bulk, without committing."""
+    return relink_labels(column, {target_id: label_ids}, replace)[target_id]
+
+def relink_labels(column, links, replace=False):
+    """Attach labels to many tasks or projects at once, without committing.
+
+    column is the owning key of the link table (TaskLabel.task_id or
+    ProjectLabel.project_id) and links maps each target id to its label
+    ids. Existing links are diffed in one query and new ones written with
+    one executemany insert; with replace, links not listed are removed in
+    the same transaction.
+    """
+    model = column.class_
+    table = model.__table__
+    existing = {}
+    if links:
+        rows = db.session.query(column, model.label_id).filter(column.in_(list(links)))
+        for target_id, label_id in rows:
+            existing.setdefault(target_id, set()).add(label_id)
+
+    added, stale, new = {}, [], []
+    for target_id, label_ids in links.items():
+        current = existing.get(target_id, set())
+        added[target_id] = [label_id for label_id in label_ids if label_id not in current]
+        new += [{column.key: target_id, "label_id": label_id} for label_id in added[target_id]]
+        if replace:
+            stale += [{"target": target_id, "label": label_id} for label_id in current - set(label_ids)]
+
+    if stale:
+        db.session.execute(table.delete().where(and_(
+            table.c[column.key] == bindparam('target'),
+            table.c.label_id == bindparam('label')
+        )), stale)
+    if new:
+        db.session.execute(table.insert(), new)
+    target = list(table.c[column.key].foreign_keys)[0].column.table
+    touch(target, {row[column.key] for row in new} | {row["target"] for row in stale})
+    return added
+
+LABEL_ORDERS = {
+    "id": [Label.id]
+}
+
+def labels_query(user_id):
+    """The /labels/all query."""
+    return Label.query.filter_by(user_id=user_id)
+
+def labelled(column, label_id):
+    """The task or project ids (column of a link table) carrying label_id."""
+    return db.session.query(column).filter(column.class_.label_id == label_id)
+
 @label.route('/labels', methods=['POST'])
 @auth_required
+@versioned
 def create_label(u=None):
     if not request.json:
         abort(400)
@@ -28,53 +100,52 @@ def create_label(u=None):
 
     return {
         "message": "Label created successfully",
-        "data": {
-            "id": label.id,
-            "name": label.name,
-            "color": label.color,
-        }
+        "data": label_schema(label)
     }, 200
 
 @label.route('/labels/<int:id>', methods=['GET'])
 @auth_required
+@etag_cached
 def get_label(id, u=None):
+    shape = label_schema.from_request()
     label = Label.query.filter_by(id=id, user_id=u.id).first()
     if not label:
         abort(404)
 
     return {
         "message": "Label retrieved successfully",
-        "data": {
-            "id": label.id,
-            "name": label.name,
-            "color": label.color,
-        }
+        "data": shape(label)
     }, 200
 
 @label.route('/labels/all', methods=['GET'])
 @auth_required 
+@etag_cached
 def get_labels(u=None):
-    labels = Label.query.filter_by(user_id=u.id).all()
+    shape = label_schema.from_request()
+    query = labels_query(u.id)
+    if wants_stream():
+        return stream_collection("Labels retrieved successfully", query, LABEL_ORDERS, shape)
+
+    page = paginate(query, LABEL_ORDERS)
+    labels = page.items
     if len(labels) > 0:
         return {
             "message": "Labels retrieved successfully",
-            "data": [
-                {
-                    "id": label.id,
-                    "name": label.name,
-                    "color": label.color,
-                } for label in labels
-            ]
+            **page.meta,
+            "data": [shape(label) for label in labels]
         }, 200
 
     abort(404)
 
 @label.route('/labels/<int:id>', methods=['DELETE'])
 @auth_required 
+@versioned
 def delete_label(id, u=None):
     label = Label.query.filter_by(id=id, user_id=u.id).first()
 
     if label:
+        touch(Task.__table__, [row.task_id for row in labelled(TaskLabel.task_id, id)])
+        touch(Project.__table__, [row.project_id for row in labelled(ProjectLabel.project_id, id)])
         db.session.delete(label)
         db.session.commit()
 
@@ -88,6 +159,7 @@ def delete_label(id, u=None):
 
 @label.route('/labels/<int:id>', methods=['PUT'])
 @auth_required 
+@versioned
 def uptade_label(id, u=None):
     if not request.json:
         abort(400)
@@ -101,11 +173,7 @@ def uptade_label(id, u=None):
 
         return {
             "message": "Labels updated successfully",
-            "data":{
-                "id": label.id,
-                "name": label.name,
-                "color": label.color,
-            }
+            "data": label_schema(label)
         }, 200
 
     return {
@@ -0,0 +1,30 @@
+from sqlalchemy.orm import joinedload, selectinload
+from .models import Task, Project, TaskLabel, ProjectLabel
+
+# Each loader returns the query with the eager loads needed to serialize
+# the whole result, so a collection costs the same handful of queries
+# whether it holds one row or thousands. Relations a response will not
+# render are left out.
+
+TASK_RELATIONS = frozenset(('creator', 'project', 'labels'))
+PROJECT_RELATIONS = frozenset(('creator', 'tasks', 'labels'))
+
+def load_tasks(query, relations=TASK_RELATIONS):
+    options = []
+    if 'creator' in relations:
+        options.append(joinedload(Task.creator))
+    if 'project' in relations:
+        options.append(joinedload(Task.project))
+    if 'labels' in relations:
+        options.append(selectinload(Task.labels).joinedload(TaskLabel.label))
+    return query.options(*options)
+
+def load_projects(query, relations=PROJECT_RELATIONS):
+    options = []
+    if 'creator' in relations:
+        options.append(joinedload(Project.manager))
+    if 'labels' in relations:
+        options.append(selectinload(Project.labels).joinedload(ProjectLabel.label))
+    if 'tasks' in relations:
+        options.append(selectinload(Project.tasks).selectinload(Task.labels).joinedload(TaskLabel.label))
+    return query.options(*options)
@@ -0,0 +1,150 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram():
+    """Cumulative Prometheus-style histogram, one series per endpoint."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((endpoint, list(counts), count, total) for endpoint, (counts, count, total) in self._series.items())
+        for endpoint, counts, count, total in series:
+            for bound, value in zip(self.buckets, counts):
+                lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(self.name, endpoint, bound, value))
+            lines.append('{}_bucket{{endpoint="{}",le="+Inf"}} {}'.format(self.name, endpoint, count))
+            lines.append('{}_sum{{endpoint="{}"}} {}'.format(self.name, endpoint, total))
+            lines.append('{}_count{{endpoint="{}"}} {}'.format(self.name, endpoint, count))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+class RequestMetrics():
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+def current():
+    """The collector of the request being handled, if any."""
+    if has_request_context():
+        return g.get('metrics')
+    return None
+
+@contextmanager
+def timing(name):
+    collector = current()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if collector is not None:
+            setattr(collector, name, getattr(collector, name) + time.perf_counter() - started)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collector = current()
+    if collector is not None:
+        collector.queries += 1
+        collector.db += time.perf_counter() - context._metrics_started
+
+class Metrics():
+    """Per-endpoint query count, DB, serialization and handler time.
+
+    Handler time is measured from before_request to after_request and
+    excludes JSON encoding, which is reported as serialization. Work done
+    while a streamed body is being sent happens after the response is
+    recorded and is not counted.
+    """
+
+    def __init__(self, app=None):
+        self.histograms = [
+            Histogram('planner_handler_seconds', 'Time spent in the view, excluding serialization.', DURATION_BUCKETS),
+            Histogram('planner_db_seconds', 'Time spent executing SQL.', DURATION_BUCKETS),
+            Histogram('planner_serialize_seconds', 'Time spent encoding the response body.', DURATION_BUCKETS),
+            Histogram('planner_db_queries', 'SQL statements executed.', QUERY_BUCKETS),
+        ]
+        self.exporters = []
+        self.server_timing = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.server_timing = app.config.get('SERVER_TIMING', False)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def before_request(self):
+        g.metrics = RequestMetrics()
+
+    def after_request(self, response):
+        collector = current()
+        if collector is None:
+            return response
+        g.metrics = None
+
+        handler = time.perf_counter() - collector.started - collector.serialize
+        endpoint = request.endpoint or 'unmatched'
+        handler_seconds, db_seconds, serialize_seconds, queries = self.histograms
+        handler_seconds.observe(endpoint, handler)
+        db_seconds.observe(endpoint, collector.db)
+        serialize_seconds.observe(endpoint, collector.serialize)
+        queries.observe(endpoint, collector.queries)
+
+        if self.server_timing:
+            response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}, handler;dur={:.2f}'.format(
+                collector.db * 1000, collector.queries, collector.serialize * 1000, handler * 1000
+            ))
+        return response
+
+    def register(self, exporter):
+        """Add a callable returning more exposition lines to /metrics."""
+        if exporter not in self.exporters:
+            self.exporters.append(exporter)
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        for exporter in self.exporters:
+            lines.extend(exporter())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
@@ -33,9 +33,9 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     activated = db.Column(db.Boolean, default=False)
     suspended = db.Column(db.Boolean, default=False)
-    projects = db.relationship('Project', backref='manager', lazy='dynamic', cascade="all, delete")
-    tasks  = db.relationship('Task', backref='creator', lazy='dynamic', cascade="all, delete")
-    labels = db.relationship('Label', backref='owner', lazy='dynamic', cascade="all, delete")
+    projects = db.relationship('Project', backref='manager', lazy='dynamic', cascade="all, delete", passive_deletes=True)
+    tasks  = db.relationship('Task', backref='creator', lazy='dynamic', cascade="all, delete", passive_deletes=True)
+    labels = db.relationship('Label', backref='owner', lazy='dynamic', cascade="all, delete", passive_deletes=True)
 
     @property
     def password(self):
@@ -90,46 +90,118 @@ class User(db.Model):
 class Project(db.Model):
 
     __tablename__="projects"
+    __table_args__ = (
+        db.Index('ix_projects_user_id_id', 'user_id', 'id'),
+        db.Index('ix_projects_user_id_updated_at', 'user_id', 'updated_at'),
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
     created = db.Column(db.DateTime, default=datetime.now())
     ends = db.Column(db.DateTime, nullable=False)
     completed = db.Column(db.Boolean, default=False)
-    tasks = db.relationship('Task', backref='project', lazy='dynamic', cascade="all, delete")
-    labels = db.relationship('ProjectLabel', backref='projects', lazy='dynamic', cascade="all, delete")
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    tasks = db.relationship('Task', backref='project', cascade="all, delete", passive_deletes=True)
+    labels = db.relationship('ProjectLabel', backref='projects', cascade="all, delete", passive_deletes=True)
 
 class Task(db.Model):
 
     __tablename__="tasks"
+    __table_args__ = (
+        db.Index('ix_tasks_user_id_id', 'user_id', 'id'),
+        db.Index('ix_tasks_user_id_due', 'user_id', 'due'),
+        db.Index('ix_tasks_project_id_due', 'project_id', 'due', 'id'),
+        db.Index('ix_tasks_user_id_updated_at', 'user_id', 'updated_at'),
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.Text, nullable=False)
     due = db.Column(db.DateTime)
     completed = db.Column(db.Boolean, default=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'))
-    labels = db.relationship('TaskLabel', backref='tasks', lazy='dynamic', cascade="all, delete")
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    labels = db.relationship('TaskLabel', backref='tasks', cascade="all, delete", passive_deletes=True)
 
 class Label(db.Model):
 
     __tablename__="labels"
+    __table_args__ = (
+        db.Index('ix_labels_user_id_id', 'user_id', 'id'),
+        db.Index('ix_labels_user_id_updated_at', 'user_id', 'updated_at'),
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
     color = db.Column(db.String())
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    project_labels = db.relationship('ProjectLabel', backref='label', lazy='dynamic', cascade="all, delete")
-    task_labels = db.relationship('TaskLabel', backref='label', lazy='dynamic', cascade="all, delete")
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    project_labels = db.relationship('ProjectLabel', backref='label', lazy='dynamic', cascade="all, delete", passive_deletes=True)
+    task_labels = db.relationship('TaskLabel', backref='label', lazy='dynamic', cascade="all, delete", passive_deletes=True)
 
 class ProjectLabel(db.Model):
 
     __tablename__="projectlabels"
-    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
-    label_id = db.Column(db.Integer, db.ForeignKey('labels.id'), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_projectlabels_label_id', 'label_id', 'project_id'),
+    )
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), primary_key=True)
+    label_id = db.Column(db.Integer, db.ForeignKey('labels.id', ondelete='CASCADE'), primary_key=True)
 
 class TaskLabel(db.Model):
 
     __tablename__="tasklabels"
-    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), primary_key=True)
-    label_id = db.Column(db.Integer, db.ForeignKey('labels.id'), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_tasklabels_label_id', 'label_id', 'task_id'),
+    )
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), primary_key=True)
+    label_id = db.Column(db.Integer, db.ForeignKey('labels.id', ondelete='CASCADE'), primary_key=True)
+
+class CollectionVersion(db.Model):
+
+    __tablename__="collection_versions"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Tombstone(db.Model):
+
+    __tablename__="tombstones"
+    __table_args__ = (
+        db.Index('ix_tombstones_user_id_id', 'user_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+
+    __tablename__="jobs"
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UserStats(db.Model):
+
+    __tablename__="user_stats"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    as_of = db.Column(db.Date, nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    overdue = db.Column(db.Integer, nullable=False, default=0)
+    due_today = db.Column(db.Integer, nullable=False, default=0)
+    due_week = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,144 @@
+import base64
+import binascii
+import datetime
+import json
+from flask import request, current_app, abort
+from sqlalchemy import and_, or_, false
+
+
+class Page():
+
+    def __init__(self, items, next=None, paginated=False):
+        self.items = items
+        self.next = next
+        self.paginated = paginated
+
+    @property
+    def meta(self):
+        if not self.paginated:
+            return {}
+        return {"next": self.next}
+
+def encode_cursor(order, values):
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    raw = json.dumps({"o": order, "v": values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, order, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values = data['v']
+        if data['o'] != order or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            datetime.datetime.fromisoformat(v) if v is not None and _is_datetime(col) else v
+            for col, v in zip(columns, values)
+        ]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        abort(400)
+
+def _is_datetime(column):
+    return column.type.python_type is datetime.datetime
+
+def _nullable(column):
+    return getattr(column.expression, 'nullable', False)
+
+def _after(columns, values, reverse=False):
+    column, value = columns[0], values[0]
+    if value is None:
+        # NULL cannot be compared with < or >; it sorts first ascending
+        # and last descending.
+        if len(columns) == 1:
+            return false() if reverse else column.isnot(None)
+        rest = _after(columns[1:], values[1:], reverse)
+        if reverse:
+            return and_(column.is_(None), rest)
+        return or_(column.isnot(None), and_(column.is_(None), rest))
+    beyond = column < value if reverse else column > value
+    if len(columns) == 1:
+        return beyond
+    rest = _after(columns[1:], values[1:], reverse)
+    if reverse and _nullable(column):
+        return or_(beyond, and_(column == value, rest), column.is_(None))
+    return or_(beyond, and_(column == value, rest))
+
+def order_keys(query, columns, reverse=False):
+    # NULLs sort first ascending and last descending, so a reversed order
+    # is exactly the ascending one read backwards.
+    if reverse:
+        return query.order_by(*[c.desc().nullslast() if _nullable(c) else c.desc() for c in columns])
+    return query.order_by(*[c.nullsfirst() if _nullable(c) else c for c in columns])
+
+def keys_of(item, columns):
+    return [getattr(item, c.key) for c in columns]
+
+def keyset_query(query, columns, order='id', limit=None, cursor=None):
+    """The statement keyset runs: ordered by columns, after cursor, and
+    one row past limit to tell whether there is a next page."""
+    reverse = order.startswith('-')
+    query = order_keys(query, columns, reverse)
+    if cursor is not None:
+        query = query.filter(_after(columns, decode_cursor(cursor, order, columns), reverse))
+    return query if limit is None else query.limit(limit + 1)
+
+def keyset(query, columns, order='id', limit=None, cursor=None):
+    """Order by columns (last one unique) and return the page after cursor.
+
+    An order name starting with '-' sorts descending.
+    """
+    query = keyset_query(query, columns, order, limit, cursor)
+    if limit is None:
+        return Page(query.all())
+
+    items = query.all()
+    next = None
+    if len(items) > limit:
+        items = items[:limit]
+        next = encode_cursor(order, keys_of(items[-1], columns))
+    return Page(items, next, paginated=True)
+
+def batches(query, columns, size, reverse=False):
+    """Yield the whole ordered query as lists of at most size rows.
+
+    Each batch is its own keyset query, so only one batch is held in
+    memory at a time and late batches cost the same as early ones.
+    """
+    query = order_keys(query, columns, reverse)
+    values = None
+    while True:
+        batch = query if values is None else query.filter(_after(columns, values, reverse))
+        items = batch.limit(size).all()
+        if items:
+            yield items
+        if len(items) < size:
+            return
+        values = keys_of(items[-1], columns)
+
+def order_columns(orders, default='id'):
+    """Resolve ?sort= (optionally prefixed with '-') against orders."""
+    order = request.args.get('sort', default)
+    key = order[1:] if order.startswith('-') else order
+    if key not in orders:
+        abort(400)
+    return order, orders[key]
+
+def page_args(orders, default='id', always=False):
+    """keyset's (columns, order, limit, cursor) from ?sort=, ?limit= and ?cursor=."""
+    order, columns = order_columns(orders, default)
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    if limit is None and cursor is None and not always:
+        return columns, order, None, None
+
+    limit = min(max(limit or current_app.config['PAGE_SIZE'], 1), current_app.config['MAX_PAGE_SIZE'])
+    return columns, order, limit, cursor
+
+def paginate(query, orders, default='id', always=False):
+    """Keyset-paginate query from ?limit=, ?cursor= and ?sort= when asked for.
+
+    orders maps each accepted ?sort= value to its key columns. Requests
+    without limit or cursor get the whole (ordered) collection as before,
+    unless always is set, in which case they get the first PAGE_SIZE rows.
+    """
+    return keyset(query, *page_args(orders, default, always))
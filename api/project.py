@@ -1,14 +1,33 @@
 from flask import Blueprint, request, current_app, abort
-from .models import Project, ProjectLabel, Label
+from .models import Project, ProjectLabel, Task
+from sqlalchemy import func, case, and_, or_
 import datetime
 from . import db
 from .user import admin_auth_required, auth_required
+from .versions import versioned, etag_cached
+from .label import resolve_labels, link_labels
+from .sync import record_tombstones
+from .stats import invalidate_stats
+from .loaders import load_projects, load_tasks, PROJECT_RELATIONS, TASK_RELATIONS
+from .pagination import paginate
+from .streaming import wants_stream, stream_collection
+from .serializers import project_schema, project_task_schema
+from .task import filter_tasks
 
 
 project = Blueprint("project", __name__)
 
+PROJECT_ORDERS = {
+    "id": [Project.id]
+}
+
+def projects_query(user_id, relations=PROJECT_RELATIONS):
+    """The /projects/all query."""
+    return load_projects(Project.query.filter_by(user_id=user_id), relations)
+
 @project.route('/projects', methods=['POST'])
 @auth_required
+@versioned
 def create_project(u=None):
     if not request.json:
         abort(400)
@@ -24,168 +43,152 @@ def create_project(u=None):
     creator = request.json.get('creator') 
     vals = request.json.get('ends').split("-")
     ends = datetime.datetime(int(vals[0]), int(vals[1]), int(vals[2]))
-    labels = request.json.get('labels')
+    labels, invalid = resolve_labels(u.id, request.json.get('labels'))
+    if invalid:
+        return {
+            "message": "Label not found",
+            "data": invalid
+        }, 404
+
     project = Project(name=name, description=description, user_id=creator, ends=ends)
     db.session.add(project)
+    db.session.flush()
+    link_labels(ProjectLabel.project_id, project.id, labels)
     db.session.commit()
 
-    if labels and len(labels) > 0:
-        for label in labels:
-            if Label.query.get(label) and not ProjectLabel(project_id=project.id, label_id=label):
-                project_label = ProjectLabel(project_id=project.id, label_id=label)
-                db.session.add(project_label)
-                db.session.commit()
-
+    project = load_projects(Project.query.filter_by(id=project.id)).first()
     return {
         "message": "Project created successfully",
-        "data": {
-            "id": project.id,
-            "name": project.name,
-            "description": project.description,
-            "creator": {
-                "id": project.manager.id,
-                "name": project.manager.name,
-                "email": project.manager.email,
-                "username": project.manager.username,
-                "avatar": project.manager.avatar,
-                "profile": project.manager.profile
-            },
-            "created": project.created,
-            "ends": project.ends,
-            "completed": project.completed,
-            "tasks": [
-                {
-                    "id": task.id,
-                    "name": task.name,
-                    "description": task.description,
-                    "due": task.due,
-                    "completed": task.completed,
-                    "labels": [
-                        {
-                            "id": label.label.id,
-                            "name": label.label.name,
-                            "color": label.label.name
-                        } for label in task.labels
-                    ]
-                } for task in project.tasks
-            ],
-            "labels": [
-                {
-                    "id": label.label.id,
-                    "name": label.label.name,
-                    "color": label.label.name
-                } for label in project.labels
-            ]
+        "data": project_schema(project)
+    }
+
+def summary_query(user_id, now):
+    """One GROUP BY over tasks giving per-project counts, no ORM objects."""
+    pending = or_(Task.completed.is_(None), Task.completed == False)
+    done = case([(Task.completed == True, 1)], else_=0)
+    overdue = case([(and_(pending, Task.due < now), 1)], else_=0)
+    upcoming = case([(and_(pending, Task.due >= now), Task.due)])
+    return db.session.query(
+        Project.id, Project.name, Project.ends, Project.completed,
+        func.count(Task.id).label('total'),
+        func.coalesce(func.sum(done), 0).label('done'),
+        func.coalesce(func.sum(overdue), 0).label('overdue'),
+        func.min(upcoming).label('next_due')
+    ).outerjoin(Task, Task.project_id == Project.id).filter(Project.user_id == user_id).group_by(Project.id)
+
+def summary(row):
+    return {
+        "id": row.id,
+        "name": row.name,
+        "ends": row.ends,
+        "completed": row.completed,
+        "tasks": {
+            "total": row.total,
+            "completed": row.done,
+            "overdue": row.overdue,
+            "next_due": row.next_due
         }
     }
 
+@project.route('/projects/summary', methods=['GET'])
+@auth_required
+def get_projects_summary(u=None):
+    page = paginate(summary_query(u.id, datetime.datetime.now()), PROJECT_ORDERS)
+    return {
+        "message": "Projects summary retrieved successfully",
+        **page.meta,
+        "data": [summary(row) for row in page.items]
+    }, 200
+
 @project.route('/projects/<int:id>', methods=['GET'])
 @auth_required
 def get_project(id, u=None):
-    project = Project.query.filter_by(id=id, user_id=u.id).first()
+    # Summaries depend on the clock (overdue, next due), so unlike the
+    # full representation they are not served from the ETag cache.
+    if request.args.get('view') == 'summary':
+        row = summary_query(u.id, datetime.datetime.now()).filter(Project.id == id).first()
+        if not row:
+            abort(404)
+
+        return {
+            "message": "Project summary retrieved successfully",
+            "data": summary(row)
+        }, 200
+
+    return get_project_detail(id, u=u)
+
+@etag_cached
+def get_project_detail(id, u=None):
+    shape = project_schema.from_request()
+    project = load_projects(Project.query.filter_by(id=id, user_id=u.id), shape.relations).first()
     if not project:
         abort(404)
 
     return {
         "message": "Project retrieved successfully",
-        "data": {
-            "id": project.id,
-            "name": project.name,
-            "description": project.description,
-            "creator": {
-                "id": project.manager.id,
-                "name": project.manager.name,
-                "email": project.manager.email,
-                "username": project.manager.username,
-                "avatar": project.manager.avatar,
-                "profile": project.manager.profile,
-            },
-            "created": project.created,
-            "ends": project.ends,
-            "completed": project.completed,
-            "tasks": [
-                {
-                    "id": task.id,
-                    "name": task.name,
-                    "description": task.description,
-                    "due": task.due,
-                    "completed": task.completed,
-                    "labels": [
-                        {
-                            "id": label.label.id,
-                            "name": label.label.name,
-                            "color": label.label.name
-                        } for label in task.labels
-                    ]
-                } for task in project.tasks
-            ],
-            "labels": [
-                {
-                    "id": label.label.id,
-                    "name": label.label.name,
-                    "color": label.label.name
-                } for label in project.labels
-            ] 
-        }
+        "data": shape(project)
+    }, 200
+
+# The project is fixed, so project_id leads every order and the pages
+# walk the (project_id, due, id) index.
+PROJECT_TASK_ORDERS = {
+    "due": [Task.project_id, Task.due, Task.id],
+    "id": [Task.project_id, Task.id]
+}
+
+def project_tasks_query(project_id, relations=TASK_RELATIONS):
+    """The /projects/<id>/tasks query, filtered from the request.
+
+    Ownership is checked by the caller; filtering on project_id alone lets
+    the pages walk ix_tasks_project_id_due instead of the user's due index.
+    """
+    return load_tasks(filter_tasks(Task.query.filter_by(project_id=project_id)), relations)
+
+@project.route('/projects/<int:id>/tasks', methods=['GET'])
+@auth_required
+@etag_cached
+def get_project_tasks(id, u=None):
+    if not db.session.query(Project.id).filter_by(id=id, user_id=u.id).scalar():
+        abort(404)
+
+    shape = project_task_schema.from_request()
+    query = project_tasks_query(id, shape.relations)
+    page = paginate(query, PROJECT_TASK_ORDERS, default='due', always=True)
+    return {
+        "message": "Tasks retrieved successfully",
+        **page.meta,
+        "data": [shape(task) for task in page.items]
     }, 200
 
 @project.route('/projects/all', methods=['GET'])
 @auth_required 
+@etag_cached
 def get_projects(u=None):
-    projects = Project.query.filter_by(user_id=u.id).all()
+    shape = project_schema.from_request()
+    query = projects_query(u.id, shape.relations)
+    if wants_stream():
+        return stream_collection("Projects retrieved successfully", query, PROJECT_ORDERS, shape)
+
+    page = paginate(query, PROJECT_ORDERS)
+    projects = page.items
     if len(projects) > 0:
         return {
             "message": "Projects retrieved successfully",
-            "data": [
-                {
-                    "id": project.id,
-                    "name": project.name,
-                    "description": project.description,
-                    "creator": {
-                        "id": project.manager.id,
-                        "name": project.manager.name,
-                        "email": project.manager.email,
-                        "username": project.manager.username,
-                        "avatar": project.manager.avatar,
-                        "profile": project.manager.profile
-                    },
-                    "ends": project.ends,
-                    "completed": project.completed,
-                    "tasks": [
-                        {
-                            "id": task.id,
-                            "name": task.name,
-                            "description": task.description,
-                            "due": task.due,
-                            "completed": task.completed,
-                            "labels": [
-                                {
-                                    "id": label.label.id,
-                                    "name": label.label.name,
-                                    "color": label.label.name
-                                } for label in task.labels
-                            ]
-                        } for task in project.tasks
-                    ],
-                    "labels": [
-                        {
-                            "id": label.label.id,
-                            "name": label.label.name,
-                            "color": label.label.name
-                        } for label in project.labels
-                    ]
-                } for project in projects
-            ]
+            **page.meta,
+            "data": [shape(project) for project in projects]
         }, 200
 
     abort(404)
 
 @project.route('/projects/<int:id>', methods=['DELETE'])
 @auth_required 
+@versioned
 def delete_project(id, u=None):
     project = Project.query.filter_by(id=id, user_id=u.id).first()
 
     if project:
+        record_tombstones(Task, Task.project_id == id)
+        invalidate_stats(u.id)
         db.session.delete(project)
         db.session.commit()
 
@@ -199,6 +202,7 @@ def delete_project(id, u=None):
 
 @project.route('/projects/<int:id>', methods=['PUT'])
 @auth_required 
+@versioned
 def uptade_project(id, u=None):
     if not request.json:
         abort(400)
@@ -214,47 +218,11 @@ def uptade_project(id, u=None):
     db.session.add(project)
     db.session.commit()
 
+    project = load_projects(Project.query.filter_by(id=project.id)).first()
     if project:
         return {
             "message": "Projects updated successfully",
-            "data":{
-                "id": project.id,
-                "name": project.name,
-                "description": project.description,
-                "creator": {
-                    "id": project.manager.id,
-                    "name": project.manager.name,
-                    "email": project.manager.email,
-                    "username": project.manager.username,
-                    "avatar": project.manager.avatar,
-                    "profile": project.manager.profile
-                },
-                "ends": project.ends,
-                "completed": project.completed,
-                "tasks": [
-                    {
-                        "id": task.id,
-                        "name": task.name,
-                        "description": task.description,
-                        "due": task.due,
-                        "completed": task.completed,
-                        "labels": [
-                            {
-                                "id": label.label.id,
-                                "name": label.label.name,
-                                "color": label.label.name
-                            } for label in task.labels
-                        ]
-                    } for task in project.tasks
-                ],
-                "labels": [
-                    {
-                        "id": label.label.id,
-                        "name": label.label.name,
-                        "color": label.label.name
-                    } for label in project.labels
-                ]
-            }
+            "data": project_schema(project)
         }, 200
 
     return {
@@ -263,6 +231,7 @@ def uptade_project(id, u=None):
 
 @project.route('/projects/<int:id>/labels', methods=['DELETE'])
 @auth_required
+@versioned
 def delete_project_label(id, u=None):
     project = Project.query.get(id)
     if not project.user_id == u.id:
@@ -275,6 +244,7 @@ def delete_project_label(id, u=None):
     if not p_label:
         abort(404)
     db.session.delete(p_label)
+    project.updated_at = datetime.datetime.utcnow()
     db.session.commit()
 
     return {
@@ -283,6 +253,7 @@ def delete_project_label(id, u=None):
 
 @project.route('/projects/<int:id>/labels', methods=['POST'])
 @auth_required
+@versioned
 def add_project_label(id, u=None):
     project = Project.query.get(id)
     if not project.user_id == u.id:
@@ -292,15 +263,42 @@ def add_project_label(id, u=None):
         abort(400)
 
     labels = request.json.get('labels')
-    print(labels)
     if labels and len(labels) > 0:
-        for label in labels:
-            if Label.query.get(label) and not ProjectLabel.query.filter_by(label_id=label, project_id=id).first():
-                p_label = ProjectLabel(project_id=id, label_id=label)
-                db.session.add(p_label)
-                db.session.commit()
+        labels, invalid = resolve_labels(u.id, labels)
+        if invalid:
+            return {
+                "message": "Label not found",
+                "data": invalid
+            }, 404
+        link_labels(ProjectLabel.project_id, id, labels)
+        db.session.commit()
         return {
             "message": "Label was added successfully"
         }, 200
 
     abort(400)
+
+@project.route('/projects/<int:id>/labels', methods=['PUT'])
+@auth_required
+@versioned
+def replace_project_labels(id, u=None):
+    project = Project.query.get(id)
+    if not project or not project.user_id == u.id:
+        abort(404)
+
+    if not request.json or not isinstance(request.json.get('labels'), list):
+        abort(400)
+
+    labels, invalid = resolve_labels(u.id, request.json.get('labels'))
+    if invalid:
+        return {
+            "message": "Label not found",
+            "data": invalid
+        }, 404
+    link_labels(ProjectLabel.project_id, id, labels, replace=True)
+    db.session.commit()
+
+    return {
+        "message": "Labels were replaced successfully",
+        "data": labels
+    }, 200
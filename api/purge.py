@@ -0,0 +1,39 @@
+from flask import current_app
+from sqlalchemy import select, func
+from . import db
+from .models import User, Task, Project, Label, Tombstone
+from .jobs import job
+
+
+def account_size(user_id):
+    return db.session.query(func.count(Task.id)).filter(Task.user_id == user_id).scalar()
+
+def purge_user(user_id, chunk_size):
+    """Delete a user and everything they own chunk_size rows at a time.
+
+    Each chunk is its own transaction, so no statement or lock grows with
+    the account; link rows go with their task, project or label through
+    ON DELETE CASCADE. Rows written while the purge runs are cascaded by
+    the final delete of the user.
+    """
+    for model in (Task, Project, Label):
+        table = model.__table__
+        while True:
+            ids = [row.id for row in db.session.execute(
+                select([table.c.id]).where(table.c.user_id == user_id).limit(chunk_size)
+            )]
+            if ids:
+                db.session.execute(table.delete().where(table.c.id.in_(ids)))
+                db.session.commit()
+            if len(ids) < chunk_size:
+                break
+
+    user = User.query.get(user_id)
+    if user:
+        db.session.delete(user)
+    Tombstone.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+
+@job('purge_user')
+def purge_user_job(user_id):
+    purge_user(user_id, current_app.config['PURGE_CHUNK_SIZE'])
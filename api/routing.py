@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import request, g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@contextmanager
+def use_primary():
+    """Send the reads made inside the block to the primary."""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('use_primary', False)
+    g.use_primary = True
+    try:
+        yield
+    finally:
+        g.use_primary = previous
+
+class ReplicaRouter():
+    """Chooses the replica bind for a request and tracks read-after-write pins.
+
+    A pin is kept in this process and also sent to the client in the
+    REPLICA_PIN_COOKIE cookie, so the client's next reads stay on the
+    primary when another worker serves them. Clients that drop cookies
+    only get read-after-write from the worker that took the write.
+    """
+
+    def __init__(self, binds, pin_seconds, cookie=None):
+        self.binds = binds
+        self.pin_seconds = pin_seconds
+        self.cookie = cookie
+        self._pins = {}
+        self._lock = threading.Lock()
+
+    def pin(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._pins) > 10000:
+                self._pins = {k: v for k, v in self._pins.items() if v > now}
+            self._pins[user_id] = now + self.pin_seconds
+
+    def pinned(self, user_id):
+        return self._pins.get(user_id, 0) > time.monotonic()
+
+    def cookie_pinned(self):
+        try:
+            return float(request.cookies.get(self.cookie, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def bind_for_request(self):
+        """Replica bind for this request, or None to use the primary."""
+        if not self.binds or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if g.get('use_primary') or (self.cookie and self.cookie_pinned()):
+            return None
+        user_id = g.get('identity_id')
+        if user_id is not None and self.pinned(user_id):
+            return None
+        if 'replica_bind' not in g:
+            g.replica_bind = random.choice(self.binds)
+        return g.replica_bind
+
+class RoutingSession(SignallingSession):
+    """Sends reads of read-only requests to a replica, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and not isinstance(clause, UpdateBase):
+            router = self.app.extensions.get('replica_router')
+            bind = router.bind_for_request() if router else None
+            if bind is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=bind)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def init_app(self, app):
+        replicas = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        names = []
+        for index, uri in enumerate(replicas):
+            name = 'replica_{}'.format(index)
+            binds[name] = uri
+            names.append(name)
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        super(RoutingSQLAlchemy, self).init_app(app)
+
+        router = ReplicaRouter(names, app.config.get('REPLICA_PIN_SECONDS', 5), app.config.get('REPLICA_PIN_COOKIE'))
+        app.extensions['replica_router'] = router
+
+        @app.after_request
+        def pin_after_write(response):
+            if not names:
+                return response
+            if request.method not in READ_METHODS and response.status_code < 400 and 'identity_id' in g:
+                router.pin(g.identity_id)
+                if router.cookie:
+                    response.set_cookie(router.cookie, str(time.time() + router.pin_seconds),
+                                        max_age=router.pin_seconds, httponly=True)
+            return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
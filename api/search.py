@@ -0,0 +1,105 @@
+from flask import Blueprint, request, current_app, abort
+from sqlalchemy import event, DDL, text, column, Float, String, Integer
+from .models import Task, Project
+from . import db
+from .user import auth_required
+from .versions import etag_cached
+from .pagination import encode_cursor, decode_cursor
+
+
+search = Blueprint("search", __name__)
+
+# External-content FTS5 indexes over the name and description of tasks and
+# projects, kept in sync by triggers so every write path (ORM, bulk Core
+# inserts, cascades) updates them. The migrations that create the indexes,
+# or recreate the tables and so drop the triggers, run these statements.
+def fts_ddl(table):
+    index = table + '_fts'
+    columns = 'name, description'
+    values = 'new.name, new.description'
+    old = "INSERT INTO {index}({index}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);".format(index=index)
+    new = "INSERT INTO {index}(rowid, name, description) VALUES (new.id, {values});".format(index=index, values=values)
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({columns}, content='{table}', content_rowid='id')".format(index=index, columns=columns, table=table),
+        "CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON {table} BEGIN {new} END".format(index=index, table=table, new=new),
+        "CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON {table} BEGIN {old} END".format(index=index, table=table, old=old),
+        "CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE OF name, description ON {table} BEGIN {old} {new} END".format(index=index, table=table, old=old, new=new),
+    ]
+
+def fts_rebuild(table):
+    return "INSERT INTO {index}({index}) VALUES ('rebuild')".format(index=table + '_fts')
+
+SEARCHABLE = ('tasks', 'projects')
+
+for model in (Task, Project):
+    for statement in fts_ddl(model.__tablename__):
+        event.listen(model.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+def rebuild_index():
+    """Create any missing FTS tables and triggers and reindex existing rows."""
+    for table in SEARCHABLE:
+        for statement in fts_ddl(table):
+            db.session.execute(statement)
+        db.session.execute(fts_rebuild(table))
+    db.session.commit()
+
+SEARCH_KEYS = [column('rank', Float), column('kind', String), column('id', Integer)]
+
+SEARCH_SQL = """
+SELECT * FROM (
+    SELECT bm25(tasks_fts) AS rank, 'task' AS kind, tasks.id AS id, tasks.name AS name
+    FROM tasks_fts JOIN tasks ON tasks.id = tasks_fts.rowid
+    WHERE tasks_fts MATCH :q AND tasks.user_id = :user_id
+    UNION ALL
+    SELECT bm25(projects_fts), 'project', projects.id, projects.name
+    FROM projects_fts JOIN projects ON projects.id = projects_fts.rowid
+    WHERE projects_fts MATCH :q AND projects.user_id = :user_id
+)
+WHERE :after = 0 OR rank > :rank OR (rank = :rank AND (kind > :kind OR (kind = :kind AND id > :id)))
+ORDER BY rank, kind, id
+LIMIT :limit
+"""
+
+def match_expression(q):
+    # Quote every term so user input cannot inject FTS5 syntax; each term
+    # is a prefix match and all of them must appear.
+    terms = [term.replace('"', '""') for term in q.split()]
+    return ' '.join('"{}"*'.format(term) for term in terms if term)
+
+@search.route('/search', methods=['GET'])
+@auth_required
+@etag_cached
+def search_workspace(u=None):
+    if db.engine.dialect.name != 'sqlite':
+        return {
+            "message": "Search is only available on SQLite"
+        }, 501
+
+    q = match_expression(request.args.get('q', ''))
+    if not q:
+        abort(400)
+    limit = min(max(request.args.get('limit', type=int) or current_app.config['PAGE_SIZE'], 1), current_app.config['MAX_PAGE_SIZE'])
+    cursor = request.args.get('cursor')
+    rank, kind, id = decode_cursor(cursor, 'search', SEARCH_KEYS) if cursor else (0, '', 0)
+
+    rows = db.session.execute(text(SEARCH_SQL), {
+        "q": q, "user_id": u.id, "after": 1 if cursor else 0,
+        "rank": rank, "kind": kind, "id": id, "limit": limit + 1
+    }).fetchall()
+    next = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next = encode_cursor('search', [rows[-1].rank, rows[-1].kind, rows[-1].id])
+
+    return {
+        "message": "Search results retrieved successfully",
+        "next": next,
+        "data": [
+            {
+                "type": row.kind,
+                "id": row.id,
+                "name": row.name,
+                "rank": row.rank
+            } for row in rows
+        ]
+    }, 200
@@ -0,0 +1,107 @@
+from operator import attrgetter
+from flask import request, abort
+
+
+class Shape():
+    """A compiled serializer for one selection of fields and relations."""
+
+    def __init__(self, fields, relations):
+        self.fields = tuple(fields)
+        self.relations = frozenset(name for name, _, _, _ in relations)
+        self._nested = tuple(relations)
+        if len(self.fields) == 1:
+            single = attrgetter(self.fields[0])
+            self._values = lambda obj: (single(obj),)
+        elif self.fields:
+            self._values = attrgetter(*self.fields)
+        else:
+            self._values = lambda obj: ()
+
+    def __call__(self, obj):
+        data = dict(zip(self.fields, self._values(obj)))
+        for name, source, child, many in self._nested:
+            value = source(obj)
+            if many:
+                data[name] = [child(item) for item in value]
+            else:
+                data[name] = child(value) if value is not None else None
+        return data
+
+class Schema():
+    """Per-model field list with nested relations, compiled into Shapes.
+
+    The default shape is compiled when the schema is declared; sparse
+    shapes requested through ?fields= / ?include= / ?exclude= are compiled
+    on first use and memoized, as there are only finitely many of them.
+    """
+
+    def __init__(self, fields, relations=None):
+        self.fields = tuple(fields)
+        self.relations = relations or {}
+        self._shapes = {}
+        self.default = self.select()
+
+    def select(self, fields=None, include=None, exclude=None):
+        wanted = frozenset(self.fields) | frozenset(self.relations) if fields is None else frozenset(fields)
+        wanted = (wanted | frozenset(include or ())) - frozenset(exclude or ())
+        shape = self._shapes.get(wanted)
+        if shape is None:
+            shape = Shape(
+                [name for name in self.fields if name in wanted],
+                [(name, source, schema.default, many)
+                 for name, (source, schema, many) in self.relations.items() if name in wanted]
+            )
+            self._shapes[wanted] = shape
+        return shape
+
+    def from_request(self):
+        fields = _names(request.args.get('fields'))
+        include = _names(request.args.get('include'))
+        exclude = _names(request.args.get('exclude'))
+        known = set(self.fields) | set(self.relations)
+        for name in (fields or []) + (include or []) + (exclude or []):
+            if name not in known:
+                abort(400)
+        return self.select(fields, include, exclude)
+
+    def __call__(self, obj):
+        return self.default(obj)
+
+def _names(value):
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+def _labels(obj):
+    return [link.label for link in obj.labels]
+
+
+user_schema = Schema(('id', 'username', 'name', 'email', 'is_admin', 'activated', 'suspended', 'avatar', 'profile'))
+creator_schema = Schema(('id', 'name', 'email', 'username', 'avatar', 'profile'))
+label_schema = Schema(('id', 'name', 'color'))
+
+task_project_schema = Schema(('id', 'name', 'description', 'ends'))
+project_task_schema = Schema(('id', 'name', 'description', 'due', 'completed'), {
+    'labels': (_labels, label_schema, True)
+})
+
+task_schema = Schema(('id', 'name', 'description', 'due', 'completed'), {
+    'creator': (attrgetter('creator'), creator_schema, False),
+    'project': (attrgetter('project'), task_project_schema, False),
+    'labels': (_labels, label_schema, True)
+})
+
+project_schema = Schema(('id', 'name', 'description', 'created', 'ends', 'completed'), {
+    'creator': (attrgetter('manager'), creator_schema, False),
+    'tasks': (attrgetter('tasks'), project_task_schema, True),
+    'labels': (_labels, label_schema, True)
+})
+
+label_ref_schema = Schema(('id',))
+label_sync_schema = Schema(('id', 'name', 'color', 'updated_at'))
+project_sync_schema = Schema(('id', 'name', 'description', 'created', 'ends', 'completed', 'updated_at'), {
+    'labels': (_labels, label_ref_schema, True)
+})
+task_sync_schema = Schema(('id', 'name', 'description', 'due', 'completed', 'project_id', 'updated_at'), {
+    'labels': (_labels, label_ref_schema, True)
+})
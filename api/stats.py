@@ -0,0 +1,117 @@
+import datetime
+from sqlalchemy import func, case, and_, or_, select, literal
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import Task, UserStats
+from .routing import use_primary
+
+COUNTERS = ('total', 'completed', 'overdue', 'due_today', 'due_week')
+
+
+def _window(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    return start, start + datetime.timedelta(days=1), start + datetime.timedelta(days=7)
+
+def counters(due, completed, day):
+    """What one task adds to each counter, as of day."""
+    start, tomorrow, week = _window(day)
+    pending = not completed and due is not None
+    return {
+        'total': 1,
+        'completed': 1 if completed else 0,
+        'overdue': int(pending and due < start),
+        'due_today': int(pending and start <= due < tomorrow),
+        'due_week': int(pending and start <= due < week)
+    }
+
+def _aggregates(day):
+    start, tomorrow, week = _window(day)
+    pending = or_(Task.completed.is_(None), Task.completed == False)
+
+    def count(condition):
+        return func.coalesce(func.sum(case([(condition, 1)], else_=0)), 0)
+
+    return [
+        func.count(Task.id),
+        count(Task.completed == True),
+        count(and_(pending, Task.due < start)),
+        count(and_(pending, Task.due >= start, Task.due < tomorrow)),
+        count(and_(pending, Task.due >= start, Task.due < week))
+    ]
+
+def count_stats(user_id, day):
+    """The counters computed from the tasks table, as of day."""
+    row = db.session.query(*_aggregates(day)).filter(Task.user_id == user_id).one()
+    return dict(zip(COUNTERS, row))
+
+def rebuild_stats(user_id, day=None):
+    """Recount user_id's row as of day (today); the caller commits.
+
+    The count and the write are one statement, so they run together on
+    the primary and no concurrent task write can fall between them.
+    """
+    day = day or datetime.date.today()
+    table = UserStats.__table__
+    aggregates = _aggregates(day)
+    result = db.session.execute(table.update().where(table.c.user_id == user_id).values(as_of=day, **{
+        name: select([aggregate]).where(Task.user_id == user_id).as_scalar()
+        for name, aggregate in zip(COUNTERS, aggregates)
+    }))
+    if result.rowcount == 0:
+        db.session.execute(table.insert().from_select(
+            ['user_id', 'as_of'] + list(COUNTERS),
+            select([literal(user_id, table.c.user_id.type), literal(day, table.c.as_of.type)] + aggregates).where(Task.user_id == user_id)
+        ))
+
+def _read(user_id):
+    table = UserStats.__table__
+    return db.session.execute(table.select().where(table.c.user_id == user_id)).first()
+
+def get_stats(user_id):
+    """The counters as of today.
+
+    Usually one primary key read. Overdue and due-soon counts are relative
+    to the day, so a row from an earlier day, or one that was invalidated,
+    is recounted with one aggregate over the user's tasks, on the primary:
+    a replica's lagging count would be the base of the day's deltas.
+    """
+    today = datetime.date.today()
+    row = _read(user_id)
+    if row is None or row.as_of != today:
+        with use_primary():
+            try:
+                rebuild_stats(user_id, today)
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent read inserted the row first.
+                db.session.rollback()
+            row = _read(user_id)
+    return {"as_of": row.as_of, **{name: row[name] for name in COUNTERS}}
+
+def track_tasks(user_id, changes):
+    """Apply task changes to user_id's counters in the current transaction.
+
+    changes holds (before, after) pairs of (due, completed), with None
+    for the side of an insert or delete that has no task. Only a row
+    counted as of today is updated; any other is recounted when read.
+    """
+    today = datetime.date.today()
+    delta = dict.fromkeys(COUNTERS, 0)
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is not None:
+                for name, value in counters(state[0], state[1], today).items():
+                    delta[name] += sign * value
+    delta = {name: value for name, value in delta.items() if value}
+    if not delta:
+        return
+
+    table = UserStats.__table__
+    db.session.execute(table.update().where(and_(table.c.user_id == user_id, table.c.as_of == today)).values({
+        table.c[name]: table.c[name] + value for name, value in delta.items()
+    }))
+
+def invalidate_stats(user_id):
+    """Drop user_id's counters, for writes that bypass track_tasks; the
+    next read recounts them."""
+    db.session.query(UserStats).filter_by(user_id=user_id).delete(synchronize_session=False)
@@ -0,0 +1,28 @@
+from flask import Response, request, current_app, stream_with_context
+from .pagination import batches, order_columns
+
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def stream_collection(message, query, orders, serialize, default='id'):
+    """Stream {"message": ..., "data": [...]} one keyset batch at a time.
+
+    Rows are fetched STREAM_BATCH_SIZE at a time and each element is
+    encoded as soon as it is serialized, so peak memory is bounded by the
+    batch size rather than by the size of the collection.
+    """
+    order, columns = order_columns(orders, default)
+    size = current_app.config['STREAM_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '{"message": ' + dumps(message) + ', "data": ['
+        separator = ''
+        for items in batches(query, columns, size, order.startswith('-')):
+            for item in items:
+                yield separator + dumps(serialize(item))
+                separator = ', '
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
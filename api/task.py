@@ -1,14 +1,82 @@
 from flask import Blueprint, request, current_app, abort
-from .models import Task, TaskLabel, Label
+from .models import Task, TaskLabel, Project
+from sqlalchemy import and_, or_, exists
+from sqlalchemy.exc import IntegrityError
 import datetime
 from . import db
 from .user import admin_auth_required, auth_required
+from .versions import versioned, etag_cached
+from .label import resolve_labels, link_labels, relink_labels
+from .loaders import load_tasks, TASK_RELATIONS
+from .pagination import paginate
+from .streaming import wants_stream, stream_collection
+from .serializers import task_schema
+from .stats import track_tasks
+from .workspace import allocate_ids
 
 
 task = Blueprint("task", __name__)
 
+TASK_ORDERS = {
+    "id": [Task.id],
+    "due": [Task.due, Task.id]
+}
+
+def _parse_datetime(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return _parse_due(value)
+
+def _id_list(value):
+    return [int(part) for part in value.split(',') if part.strip()]
+
+def filter_tasks(query):
+    """Apply the ?due_before=, ?due_after=, ?completed=, ?project= and
+    ?label= (with ?label_match=any|all) filters as SQL predicates."""
+    args = request.args
+    try:
+        if 'due_before' in args:
+            query = query.filter(Task.due < _parse_datetime(args['due_before']))
+        if 'due_after' in args:
+            query = query.filter(Task.due >= _parse_datetime(args['due_after']))
+        if 'project' in args:
+            query = query.filter(Task.project_id == int(args['project']))
+        labels = _id_list(args['label']) if 'label' in args else []
+    except (ValueError, IndexError):
+        abort(400)
+
+    if 'completed' in args:
+        completed = args['completed'].lower()
+        if completed not in ('true', 'false', '1', '0'):
+            abort(400)
+        if completed in ('true', '1'):
+            query = query.filter(Task.completed == True)
+        else:
+            query = query.filter(or_(Task.completed == False, Task.completed.is_(None)))
+
+    if labels:
+        match = args.get('label_match', 'any')
+        if match == 'any':
+            query = query.filter(exists().where(and_(
+                TaskLabel.task_id == Task.id, TaskLabel.label_id.in_(labels)
+            )))
+        elif match == 'all':
+            for label_id in set(labels):
+                query = query.filter(exists().where(and_(
+                    TaskLabel.task_id == Task.id, TaskLabel.label_id == label_id
+                )))
+        else:
+            abort(400)
+    return query
+
+def tasks_query(user_id, relations=TASK_RELATIONS):
+    """The /tasks/all query: the user's tasks, filtered from the request."""
+    return load_tasks(filter_tasks(Task.query.filter_by(user_id=user_id)), relations)
+
 @task.route('/tasks', methods=['POST'])
 @auth_required
+@versioned
 def create_task(u=None):
     if not request.json:
         abort(400)
@@ -25,136 +93,68 @@ def create_task(u=None):
     project = request.json.get('project')
     vals = request.json.get('due').split("-")
     due = datetime.datetime(int(vals[0]), int(vals[1]), int(vals[2]))
-    labels = request.json.get('labels')
+    labels, invalid = resolve_labels(u.id, request.json.get('labels'))
+    if invalid:
+        return {
+            "message": "Label not found",
+            "data": invalid
+        }, 404
+
     task = Task(name=name, description=description, user_id=creator, project_id=project, due=due)
     db.session.add(task)
+    db.session.flush()
+    link_labels(TaskLabel.task_id, task.id, labels)
+    track_tasks(u.id, [(None, (task.due, task.completed))])
     db.session.commit()
 
-    if labels and len(labels) > 0:
-        for label in labels:
-            if Label.query.get(label) and not TaskLabel(task_id=task.id, label_id=label):
-                task_label = TaskLabel(task_id=task.id, label_id=label)
-                db.session.add(task_label)
-                db.session.commit()
-
+    task = load_tasks(Task.query.filter_by(id=task.id)).first()
     return {
         "message": "Task created successfully",
-        "data": {
-            "id": task.id,
-            "name": task.name,
-            "description": task.description,
-            "creator": {
-                "id": task.creator.id,
-                "name": task.creator.name,
-                "email": task.creator.email,
-                "username": task.creator.username,
-                "avatar": task.creator.avatar,
-                "profile": task.creator.profile
-            },
-            "project": {
-                "id": task.project.id,
-                "name": task.project.name,
-                "description": task.project.description,
-                "ends": task.project.ends
-            },
-            "due": task.due,
-            "completed": task.completed,
-            "labels": [
-                {
-                    "id": label.label.id,
-                    "name": label.label.name,
-                    "color": label.label.name
-                } for label in task.labels
-            ]
-        }
+        "data": task_schema(task)
     }, 200
 
 @task.route('/tasks/<int:id>', methods=['GET'])
 @auth_required
+@etag_cached
 def get_task(id, u=None):
-    task = Task.query.filter_by(id=id, user_id=u.id).first()
+    shape = task_schema.from_request()
+    task = load_tasks(Task.query.filter_by(id=id, user_id=u.id), shape.relations).first()
     if not task:
         abort(404)
 
     return {
         "message": "Task retrieved successfully",
-        "data": {
-            "id": task.id,
-            "name": task.name,
-            "description": task.description,
-            "creator": {
-                "id": task.creator.id,
-                "name": task.creator.name,
-                "email": task.creator.email,
-                "username": task.creator.username,
-                "avatar": task.creator.avatar,
-                "profile": task.creator.profile
-            },
-            "project": {
-                "id": task.project.id,
-                "name": task.project.name,
-                "description": task.project.description,
-                "ends": task.project.ends
-            },
-            "due": task.due,
-            "completed": task.completed,
-            "labels": [
-                {
-                    "id": label.label.id,
-                    "name": label.label.name,
-                    "color": label.label.name
-                } for label in task.labels
-            ] 
-        }
+        "data": shape(task)
     }, 200
 
 @task.route('/tasks/all', methods=['GET'])
 @auth_required 
+@etag_cached
 def get_tasks(u=None):
-    tasks = Task.query.filter_by(user_id=u.id).all()
+    shape = task_schema.from_request()
+    query = tasks_query(u.id, shape.relations)
+    if wants_stream():
+        return stream_collection("Tasks retrieved successfully", query, TASK_ORDERS, shape)
+
+    page = paginate(query, TASK_ORDERS)
+    tasks = page.items
     if len(tasks) > 0:
         return {
             "message": "Tasks retrieved successfully",
-            "data": [
-                {
-                    "id": task.id,
-                    "name": task.name,
-                    "description": task.description,
-                    "creator": {
-                        "id": task.creator.id,
-                        "name": task.creator.name,
-                        "email": task.creator.email,
-                        "username": task.creator.username,
-                        "avatar": task.creator.avatar,
-                        "profile": task.creator.profile
-                    },
-                    "project": {
-                        "id": task.project.id,
-                        "name": task.project.name,
-                        "description": task.project.description,
-                        "ends": task.project.ends
-                    },
-                    "due": task.due,
-                    "completed": task.completed,
-                    "labels": [
-                        {
-                            "id": label.label.id,
-                            "name": label.label.name,
-                            "color": label.label.name
-                        } for label in task.labels
-                    ]
-                } for task in tasks
-            ]
+            **page.meta,
+            "data": [shape(task) for task in tasks]
         }, 200
 
     abort(404)
 
 @task.route('/tasks/<int:id>', methods=['DELETE'])
 @auth_required 
+@versioned
 def delete_task(id, u=None):
     task = Task.query.filter_by(id=id, user_id=u.id).first()
 
     if task:
+        track_tasks(u.id, [((task.due, task.completed), None)])
         db.session.delete(task)
         db.session.commit()
 
@@ -168,52 +168,29 @@ def delete_task(id, u=None):
 
 @task.route('/tasks/<int:id>', methods=['PUT'])
 @auth_required 
+@versioned
 def uptade_task(id, u=None):
     if not request.json:
         abort(400)
 
     task = Task.query.filter_by(id=id, user_id=u.id).first()
     if task:
+        before = (task.due, task.completed)
         task.name = request.json.get("name") or task.name
         task.description = request.json.get("description") or task.description
         vals = request.json.get('due').split("-")
         due = datetime.datetime(int(vals[0]), int(vals[1]), int(vals[2]))
         task.due = due or task.due
         task.completed = request.json.get("completed") or task.completed
+        track_tasks(u.id, [(before, (task.due, task.completed))])
 
         db.session.add(task)
         db.session.commit()
 
+        task = load_tasks(Task.query.filter_by(id=task.id)).first()
         return {
             "message": "Tasks updated successfully",
-            "data":{
-                "id": task.id,
-                "name": task.name,
-                "description": task.description,
-                "creator": {
-                    "id": task.creator.id,
-                    "name": task.creator.name,
-                    "email": task.creator.email,
-                    "username": task.creator.username,
-                    "avatar": task.creator.avatar,
-                    "profile": task.creator.profile
-                },
-                "project": {
-                    "id": task.project.id,
-                    "name": task.project.name,
-                    "description": task.project.description,
-                    "ends": task.project.ends
-                },
-                "due": task.due,
-                "completed": task.completed,
-                "labels": [
-                    {
-                        "id": label.label.id,
-                        "name": label.label.name,
-                        "color": label.label.name
-                    } for label in task.labels
-                ]
-            }
+            "data": task_schema(task)
         }, 200
 
     return {
@@ -222,6 +199,7 @@ def uptade_task(id, u=None):
 
 @task.route('/tasks/<int:id>/labels', methods=['DELETE'])
 @auth_required
+@versioned
 def delete_task_label(id, u=None):
     task = Task.query.get(id)
     if not task.user_id == u.id:
@@ -234,6 +212,7 @@ def delete_task_label(id, u=None):
     if not t_label:
         abort(404)
     db.session.delete(t_label)
+    task.updated_at = datetime.datetime.utcnow()
     db.session.commit()
 
     return {
@@ -242,6 +221,7 @@ def delete_task_label(id, u=None):
 
 @task.route('/tasks/<int:id>/labels', methods=['POST'])
 @auth_required
+@versioned
 def add_task_label(id, u=None):
     task = Task.query.get(id)
     if not task.user_id == u.id:
@@ -252,13 +232,194 @@ def add_task_label(id, u=None):
 
     labels = request.json.get('labels')
     if labels and len(labels) > 0:
-        for label in labels:
-            if Label.query.get(label) and not TaskLabel.query.filter_by(label_id=label, task_id=id).first():
-                t_label = TaskLabel(task_id=id, label_id=label)
-                db.session.add(t_label)
-                db.session.commit()
+        labels, invalid = resolve_labels(u.id, labels)
+        if invalid:
+            return {
+                "message": "Label not found",
+                "data": invalid
+            }, 404
+        link_labels(TaskLabel.task_id, id, labels)
+        db.session.commit()
         return {
             "message": "Label was created successfully"
         }, 200
 
-    abort(400)
\ No newline at end of file
+    abort(400)
+
+@task.route('/tasks/<int:id>/labels', methods=['PUT'])
+@auth_required
+@versioned
+def replace_task_labels(id, u=None):
+    task = Task.query.get(id)
+    if not task or not task.user_id == u.id:
+        abort(404)
+
+    if not request.json or not isinstance(request.json.get('labels'), list):
+        abort(400)
+
+    labels, invalid = resolve_labels(u.id, request.json.get('labels'))
+    if invalid:
+        return {
+            "message": "Label not found",
+            "data": invalid
+        }, 404
+    link_labels(TaskLabel.task_id, id, labels, replace=True)
+    db.session.commit()
+
+    return {
+        "message": "Labels were replaced successfully",
+        "data": labels
+    }, 200
+
+def _parse_due(value):
+    vals = value.split("-")
+    return datetime.datetime(int(vals[0]), int(vals[1]), int(vals[2]))
+
+def _batch_item(item, u, projects, labels, partial):
+    if not isinstance(item, dict):
+        return None, None, "Item must be an object"
+    if item.get('creator', u.id) != u.id:
+        return None, None, "No read or write access to endpoint"
+
+    fields = {}
+    for key in ('name', 'description'):
+        if item.get(key):
+            fields[key] = item[key]
+        elif not partial or key in item:
+            return None, None, "Missing " + key
+    if 'due' in item:
+        try:
+            fields['due'] = _parse_due(item['due'])
+        except (AttributeError, TypeError, ValueError, IndexError):
+            return None, None, "Invalid due date"
+    if 'completed' in item:
+        fields['completed'] = bool(item['completed'])
+    if item.get('project') is not None:
+        if item['project'] not in projects:
+            return None, None, "Project not found"
+        fields['project_id'] = item['project']
+
+    item_labels = None
+    if 'labels' in item:
+        item_labels = item['labels']
+        if not isinstance(item_labels, list) or not all(isinstance(l, int) and l in labels for l in item_labels):
+            return None, None, "Label not found"
+        item_labels = list(dict.fromkeys(item_labels))
+    return fields, item_labels, None
+
+def _validate_batch(items, u, partial=False):
+    """Validate a whole batch, checking project and label ownership in bulk."""
+    dicts = [item for item in items if isinstance(item, dict)]
+    project_ids = {item['project'] for item in dicts if isinstance(item.get('project'), int)}
+    label_ids = [l for item in dicts if isinstance(item.get('labels'), list) for l in item['labels']]
+
+    projects = set()
+    if project_ids:
+        rows = db.session.query(Project.id).filter(Project.user_id == u.id, Project.id.in_(project_ids))
+        projects = {row.id for row in rows}
+    labels, _ = resolve_labels(u.id, label_ids)
+    labels = set(labels)
+
+    results, errors = [], []
+    for index, item in enumerate(items):
+        fields, item_labels, error = _batch_item(item, u, projects, labels, partial)
+        if error:
+            errors.append({"index": index, "error": error})
+        results.append((fields, item_labels))
+    return results, errors
+
+BATCH_ATTEMPTS = 3
+
+def _batch_items():
+    items = request.json
+    if not isinstance(items, list) or len(items) == 0:
+        abort(400)
+    if len(items) > current_app.config['TASK_BATCH_LIMIT']:
+        return None, ({
+            "message": "Batches are limited to {} items".format(current_app.config['TASK_BATCH_LIMIT'])
+        }, 400)
+    return items, None
+
+@task.route('/tasks/batch', methods=['POST'])
+@auth_required
+@versioned
+def create_tasks(u=None):
+    items, error = _batch_items()
+    if error:
+        return error
+
+    results, errors = _validate_batch(items, u)
+    if errors:
+        return {
+            "message": "Batch rejected, nothing was written",
+            "data": errors
+        }, 400
+
+    rows = [{
+        "user_id": u.id,
+        "name": fields['name'],
+        "description": fields['description'],
+        "due": fields.get('due'),
+        "completed": fields.get('completed', False),
+        "project_id": fields.get('project_id')
+    } for fields, _ in results]
+    # Ids are allocated up front so the batch is one executemany insert;
+    # if a concurrent write takes one of them first, allocate again.
+    for attempt in range(BATCH_ATTEMPTS):
+        ids = allocate_ids(Task, len(rows))
+        try:
+            db.session.execute(Task.__table__.insert(), [dict(row, id=task_id) for row, task_id in zip(rows, ids)])
+            relink_labels(TaskLabel.task_id, {
+                task_id: labels for task_id, (_, labels) in zip(ids, results) if labels
+            })
+            track_tasks(u.id, [(None, (row['due'], row['completed'])) for row in rows])
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == BATCH_ATTEMPTS - 1:
+                raise
+
+    return {
+        "message": "Tasks created successfully",
+        "data": [{"id": task_id} for task_id in ids]
+    }, 200
+
+@task.route('/tasks/batch', methods=['PATCH'])
+@auth_required
+@versioned
+def update_tasks(u=None):
+    items, error = _batch_items()
+    if error:
+        return error
+
+    results, errors = _validate_batch(items, u, partial=True)
+    ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+    wanted = {task_id for task_id in ids if isinstance(task_id, int)}
+    tasks = {}
+    if wanted:
+        tasks = {task.id: task for task in Task.query.filter(Task.user_id == u.id, Task.id.in_(wanted))}
+    for index, task_id in enumerate(ids):
+        if task_id not in tasks and not any(e["index"] == index for e in errors):
+            errors.append({"index": index, "error": "Task not found"})
+    if errors:
+        return {
+            "message": "Batch rejected, nothing was written",
+            "data": sorted(errors, key=lambda e: e["index"])
+        }, 400
+
+    before = {task.id: (task.due, task.completed) for task in tasks.values()}
+    links = {}
+    for task_id, (fields, labels) in zip(ids, results):
+        for key, value in fields.items():
+            setattr(tasks[task_id], key, value)
+        if labels is not None:
+            links[task_id] = labels
+    relink_labels(TaskLabel.task_id, links, replace=True)
+    track_tasks(u.id, [(state, (tasks[task_id].due, tasks[task_id].completed)) for task_id, state in before.items()])
+    db.session.commit()
+
+    return {
+        "message": "Tasks updated successfully",
+        "data": [{"id": task_id} for task_id in ids]
+    }, 200
\ No newline at end of file
@@ -1,12 +1,65 @@
-from flask import Blueprint, request, abort, current_app
+from flask import Blueprint, request, abort, current_app, g
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from functools import wraps
-from .models import User
-from . import db
-from sqlalchemy import or_
+import time
+from .models import User, Tombstone
+from . import db, identity_cache, admission
+from .pagination import paginate
+from .streaming import wants_stream, stream_collection
+from .serializers import user_schema
+from .purge import account_size
+from .jobs import enqueue
+from .stats import get_stats
+from .versions import increment_version
+from .routing import use_primary
+from sqlalchemy import or_, event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
 
 user = Blueprint('user', __name__)
 
+def _detached_copy(user):
+    copy = User.__mapper__.class_manager.new_instance()
+    for attr in User.__mapper__.column_attrs:
+        setattr(copy, attr.key, getattr(user, attr.key))
+    make_transient_to_detached(copy)
+    return copy
+
+def load_identity(token):
+    key = identity_cache.digest(token)
+    cached = identity_cache.get(key)
+    if cached is not None:
+        return db.session.merge(cached, load=False)
+
+    s = Serializer(current_app.config['SECRET_KEY'])
+    data, header = s.loads(token, return_header=True)
+    loaded_at = time.monotonic()
+    # From the primary: a replica may not have a just-registered user yet,
+    # or may still show one as active after a suspension.
+    with use_primary():
+        user = User.query.filter_by(id=data.get('id'), email=data.get('email')).first()
+    if user:
+        identity_cache.set(key, user.id, _detached_copy(user), header.get('exp'), loaded_at)
+    return user
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_identity(mapper, connection, target):
+    # Flush time is before commit, so a concurrent miss can still read
+    # the old row; invalidate again once the change is visible.
+    identity_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('identities_changed', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_identities(session):
+    for user_id in session.info.pop('identities_changed', ()):
+        identity_cache.invalidate(user_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_changed_identities(session, previous_transaction):
+    session.info.pop('identities_changed', None)
+
 def auth_required(view):
     @wraps(view)
     def decorated_function(*args, **kwargs):
@@ -15,11 +68,9 @@ def auth_required(view):
                 "message": "Did not find any Token"
             }, 401
         try:
-            s = Serializer(current_app.config['SECRET_KEY'])
             raw_token = request.headers['Authorization']
             token = str.replace(str(raw_token), 'Bearer ', '')
-            data = s.loads(token)
-            user = User.query.filter_by(id=data.get('id'), email=data.get('email')).first()
+            user = load_identity(token)
             if not user:
                 return {
                     "message": "Couldn't get data from Token, either corrupt or expired"
@@ -30,6 +81,17 @@ def auth_required(view):
                 "message": e.__str__()
             }, 401
 
+        # Suspended accounts are being purged; writes would race the purge.
+        if user.suspended:
+            return {
+                "message": "Account is suspended"
+            }, 403
+
+        throttled = admission.throttle(user.id)
+        if throttled:
+            return throttled
+
+        g.identity_id = user.id
         return view(u=user, *args, **kwargs)
 
     return decorated_function
@@ -42,12 +104,10 @@ def admin_auth_required(view):
                 "message": "Did not find any Token"
             }, 401
         try:
-            s = Serializer(current_app.config['SECRET_KEY'])
             raw_token = request.headers['Authorization']
             token = str.replace(str(raw_token), 'Bearer ', '')
-            data = s.loads(token)
-            user = User.query.filter_by(id=data.get('id'), email=data.get('email')).first()
-            if not user and not user.is_admin:
+            user = load_identity(token)
+            if not user or not user.is_admin:
                 return {
                     "message": "Either token is corrupt or you're not authorized to access"
                 }, 401
@@ -57,6 +117,17 @@ def admin_auth_required(view):
                 "message": e.__str__()
             }, 401
 
+        # Suspended accounts are being purged; writes would race the purge.
+        if user.suspended:
+            return {
+                "message": "Account is suspended"
+            }, 403
+
+        throttled = admission.throttle(user.id)
+        if throttled:
+            return throttled
+
+        g.identity_id = user.id
         return view(u=user, *args, **kwargs)
 
     return decorated_function
@@ -72,19 +143,17 @@ def login():
     
     user = User.query.filter_by(email=email).first()
     if user and user.verify_password(password):
+        if user.suspended:
+            return {
+                "message": "Account is suspended"
+            }, 403
+
         token = user.generate_auth_token()
+        g.identity_id = user.id
         return {
             "message": "Login success",
             "data": {
-                "id": user.id,
-                "username": user.username,
-                "name": user.name,
-                "email": user.email,
-                "is_admin": user.is_admin,
-                "activated": user.activated,
-                "suspended": user.suspended,
-                "avatar": user.avatar,
-                "profile": user.profile,
+                **user_schema(user),
                 "auth_token": token.decode()
             }
         }, 200
@@ -114,42 +183,30 @@ def register():
     user = User(name=name, email=email, username=username, password=password)
     db.session.add(user)
     db.session.commit()
+    g.identity_id = user.id
 
     return {
         "message": "Registration success",
-        "data": {
-            "id": user.id,
-            "username": user.username,
-            "name": user.name,
-            "email": user.email,
-            "is_admin": user.is_admin,
-            "activated": user.activated,
-            "suspended": user.suspended,
-            "avatar": user.avatar,
-            "profile": user.profile
-        }
+        "data": user_schema(user)
     }, 200
 
 @user.route('/users/all', methods=['GET'])
 @admin_auth_required
 def get_users(u=None):
-    users = User.query.all()
+    shape = user_schema.from_request()
+    orders = {
+        "id": [User.id]
+    }
+    if wants_stream():
+        return stream_collection("Retrieved successful", User.query, orders, shape)
+
+    page = paginate(User.query, orders)
+    users = page.items
     if len(users) > 0:
         return {
             "message": "Retrieved successful",
-            "data":[
-                {
-                    "id": user.id,
-                    "username": user.username,
-                    "name": user.name,
-                    "email": user.email,
-                    "is_admin": user.is_admin,
-                    "activated": user.activated,
-                    "suspended": user.suspended,
-                    "avatar": user.avatar,
-                    "profile": user.profile  
-                } for user in users
-            ]
+            **page.meta,
+            "data": [shape(user) for user in users]
         }, 200
 
     return {
@@ -159,6 +216,7 @@ def get_users(u=None):
 @user.route('/users/<int:id>', methods=['GET'])
 @auth_required
 def get_user(id, u=None):
+    shape = user_schema.from_request()
     user = User.query.get(id)
     if user.id != u.id and not u.is_admin:
         return {
@@ -168,22 +226,32 @@ def get_user(id, u=None):
     if user:
         return {
             "message": "Retrieved successful",
-            "data": {
-                "id": user.id,
-                "username": user.username,
-                "name": user.name,
-                "email": user.email,
-                "is_admin": user.is_admin,
-                "activated": user.activated,
-                "suspended": user.suspended,
-                "avatar": user.avatar,
-                "profile": user.profile
-            }
+            "data": shape(user)
         }, 200
     return {
         "message": "User not found"
     }, 404
 
+# Counters depend on the day, so like project summaries they are not
+# served from the ETag cache.
+@user.route('/users/<int:id>/stats', methods=['GET'])
+@auth_required
+def get_user_stats(id, u=None):
+    if id != u.id and not u.is_admin:
+        return {
+            "message": "No read or write access to endpoint"
+        }, 403
+
+    if id != u.id and not db.session.query(User.id).filter_by(id=id).scalar():
+        return {
+            "message": "User not found"
+        }, 404
+
+    return {
+        "message": "Stats retrieved successfully",
+        "data": get_stats(id)
+    }, 200
+
 @user.route('/users/<int:id>', methods=['DELETE'])
 @auth_required
 def delete_user(id, u=None):
@@ -194,7 +262,16 @@ def delete_user(id, u=None):
         }, 403
 
     if user:
+        if request.args.get('purge') == 'async' or account_size(id) > current_app.config['PURGE_ASYNC_THRESHOLD']:
+            user.suspended = True
+            enqueue('purge_user', user_id=id)
+            db.session.commit()
+            return {
+                "message": "User deletion started"
+            }, 202
+
         db.session.delete(user)
+        Tombstone.query.filter_by(user_id=id).delete(synchronize_session=False)
         db.session.commit()
         return {
             "message": "User deleted successfully"
@@ -229,21 +306,13 @@ def update(id, u=None):
         user.name = name
         user.username = username
         db.session.add(user)
+        # Tasks and projects embed their creator, so cached ETags go stale.
+        increment_version(user.id)
         db.session.commit()
 
         return {
             "message": "User updated successfully",
-            "data": {
-                "id": user.id,
-                "username": user.username,
-                "name": user.name,
-                "email": user.email,
-                "is_admin": user.is_admin,
-                "activated": user.activated,
-                "suspended": user.suspended,
-                "avatar": user.avatar,
-                "profile": user.profile
-            }
+            "data": user_schema(user)
         }, 200
     return {
         "message": "User not found"
@@ -0,0 +1,62 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import db
+from .models import CollectionVersion
+
+
+def current_version(user_id):
+    version = db.session.query(CollectionVersion.version).filter_by(user_id=user_id).scalar()
+    return version or 0
+
+def increment_version(user_id, session=None):
+    """Bump user_id's collection version in the current transaction."""
+    session = session or db.session
+    table = CollectionVersion.__table__
+    result = session.execute(
+        table.update().where(table.c.user_id == user_id).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        session.execute(table.insert().values(user_id=user_id, version=1))
+
+@event.listens_for(Session, 'before_commit')
+def increment_versioned(session):
+    user_id = session.info.get('versioned_user')
+    if user_id is not None:
+        increment_version(user_id, session)
+
+def versioned(view):
+    """Bump the caller's collection version in every transaction the view
+    commits, so a write and its new ETag are applied or lost together."""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        db.session.info['versioned_user'] = kwargs['u'].id
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop('versioned_user', None)
+
+    return decorated_function
+
+def etag_cached(view):
+    """Answer GETs with a weak ETag from the caller's collection version.
+
+    A matching If-None-Match gets a 304 before the view, and so before any
+    task, project or label table, is touched.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        u = kwargs['u']
+        variant = hashlib.md5(request.full_path.encode('utf-8')).hexdigest()[:12]
+        tag = '{}.{}.{}'.format(u.id, current_version(u.id), variant)
+        if request.if_none_match.contains_weak(tag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        if response.status_code in (200, 304):
+            response.set_etag(tag, weak=True)
+        return response
+
+    return decorated_function
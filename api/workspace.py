@@ -0,0 +1,239 @@
+import datetime
+import json
+from flask import Blueprint, Response, request, current_app, stream_with_context
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from . import db
+from .models import Task, Project, Label, TaskLabel, ProjectLabel
+from .user import auth_required
+from .versions import versioned
+from .pagination import batches
+from .stats import invalidate_stats
+
+
+workspace = Blueprint("workspace", __name__)
+
+EXPORT_VERSION = 1
+
+# Record type -> (model, exported columns, datetime columns). Parents come
+# before the rows that reference them, in the export and on import.
+RECORDS = {
+    'label': (Label, ('id', 'name', 'color'), ()),
+    'project': (Project, ('id', 'name', 'description', 'created', 'ends', 'completed'), ('created', 'ends')),
+    'task': (Task, ('id', 'name', 'description', 'due', 'completed', 'project_id'), ('due',)),
+    'project_label': (ProjectLabel, ('project_id', 'label_id'), ()),
+    'task_label': (TaskLabel, ('task_id', 'label_id'), ()),
+}
+
+# Foreign key column -> the record type whose ids it references.
+REFERENCES = {'project_id': 'project', 'task_id': 'task', 'label_id': 'label'}
+
+def export_queries(user_id):
+    """The (record type, query, key columns) to export, in dependency order."""
+    queries = []
+    for kind in ('label', 'project', 'task'):
+        model, fields, _ = RECORDS[kind]
+        query = db.session.query(*[getattr(model, field) for field in fields]).filter(model.user_id == user_id)
+        queries.append((kind, query, [model.id]))
+    for kind, parent in (('project_label', Project), ('task_label', Task)):
+        model, fields, _ = RECORDS[kind]
+        columns = [getattr(model, field) for field in fields]
+        query = db.session.query(*columns).join(parent, parent.id == columns[0]).filter(parent.user_id == user_id)
+        queries.append((kind, query, columns))
+    return queries
+
+@workspace.route('/export', methods=['GET'])
+@auth_required
+def export_workspace(u=None):
+    size = current_app.config['STREAM_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield dumps({"type": "export", "version": EXPORT_VERSION, "exported_at": datetime.datetime.utcnow()}) + '\n'
+        for kind, query, columns in export_queries(u.id):
+            for rows in batches(query, columns, size):
+                yield ''.join(dumps(dict(row._asdict(), type=kind)) + '\n' for row in rows)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+class InvalidRecord(ValueError):
+
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+        self.message = message
+
+def _record(line_number, line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise InvalidRecord(line_number, "Invalid JSON")
+    if not isinstance(record, dict):
+        raise InvalidRecord(line_number, "Record must be an object")
+    kind = record.get('type')
+    if kind == 'export':
+        if record.get('version') != EXPORT_VERSION:
+            raise InvalidRecord(line_number, "Unsupported export version")
+        return None
+    if kind not in RECORDS:
+        raise InvalidRecord(line_number, "Unknown record type")
+    model, fields, dates = RECORDS[kind]
+    values = {}
+    for field in fields:
+        column = model.__table__.c[field]
+        value = record.get(field)
+        if value is None:
+            if not column.nullable:
+                raise InvalidRecord(line_number, "Missing {}".format(field))
+            if column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+        elif field in dates:
+            try:
+                value = datetime.datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise InvalidRecord(line_number, "Invalid {}".format(field))
+        elif not isinstance(value, column.type.python_type):
+            raise InvalidRecord(line_number, "Invalid {}".format(field))
+        values[field] = value
+    return line_number, kind, values
+
+# Dialects allocate_ids knows how to hand out primary keys on.
+IMPORT_DIALECTS = ('sqlite', 'mysql', 'postgresql')
+
+def allocate_ids(model, count):
+    """count new primary keys for model, to insert explicitly.
+
+    PostgreSQL draws them from the table's sequence, which explicit ids
+    would otherwise leave behind. SQLite and MySQL take the range above the
+    current maximum, and on SQLite above sqlite_sequence too, so an id that
+    was deleted (and tombstoned for sync) is not handed out again; both
+    continue their own numbering past the range.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        rows = db.session.execute(
+            "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)",
+            {'table': model.__tablename__, 'count': count}
+        )
+        return [row[0] for row in rows]
+    start = db.session.query(func.max(model.id)).scalar() or 0
+    # sqlite_sequence only exists once a table uses AUTOINCREMENT.
+    if dialect == 'sqlite' and db.session.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").scalar():
+        used = db.session.execute("SELECT seq FROM sqlite_sequence WHERE name = :table", {'table': model.__tablename__}).scalar()
+        start = max(start, used or 0)
+    return list(range(start + 1, start + 1 + count))
+
+class Importer():
+    """Inserts records in chunks, one transaction each, remapping ids.
+
+    New ids are allocated up front with allocate_ids, so a chunk is one
+    executemany per table. If a concurrent write takes an id above the
+    maximum first, the chunk is rolled back and allocated again.
+    """
+
+    ATTEMPTS = 3
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.ids = {kind: {} for kind in ('label', 'project', 'task')}
+        self.counts = {kind: 0 for kind in RECORDS}
+
+    def _rows(self, chunk, kind):
+        model, fields, _ = RECORDS[kind]
+        records = [(line_number, values) for line_number, record_kind, values in chunk if record_kind == kind]
+        rows = []
+        allocated = {}
+        new_ids = iter(allocate_ids(model, len(records)) if records and 'id' in fields else ())
+        for line_number, values in records:
+            row = dict(values)
+            for field, target in REFERENCES.items():
+                if field in row and row[field] is not None:
+                    new_id = self.ids[target].get(row[field])
+                    if new_id is None:
+                        raise InvalidRecord(line_number, "Unknown {} {}".format(target, row[field]))
+                    row[field] = new_id
+            if 'id' in fields:
+                if row['id'] in self.ids[kind] or row['id'] in allocated:
+                    raise InvalidRecord(line_number, "Duplicate {} {}".format(kind, row['id']))
+                new_id = next(new_ids)
+                allocated[row['id']] = new_id
+                row['id'] = new_id
+                row['user_id'] = self.user_id
+            rows.append(row)
+        return rows, allocated
+
+    def flush(self, chunk):
+        for attempt in range(self.ATTEMPTS):
+            try:
+                allocations = {}
+                counts = {}
+                for kind, (model, _, _) in RECORDS.items():
+                    rows, allocated = self._rows(chunk, kind)
+                    # Later kinds of this chunk reference the ids just allocated.
+                    self.ids.get(kind, {}).update(allocated)
+                    allocations[kind] = allocated
+                    if rows:
+                        db.session.execute(model.__table__.insert(), rows)
+                    counts[kind] = len(rows)
+                if counts['task']:
+                    invalidate_stats(self.user_id)
+                db.session.commit()
+            except (IntegrityError, OperationalError):
+                db.session.rollback()
+                self._forget(allocations)
+                if attempt == self.ATTEMPTS - 1:
+                    raise
+                continue
+            except InvalidRecord:
+                db.session.rollback()
+                self._forget(allocations)
+                raise
+            for kind, count in counts.items():
+                self.counts[kind] += count
+            return
+
+    def _forget(self, allocations):
+        for kind, allocated in allocations.items():
+            for old_id in allocated:
+                self.ids[kind].pop(old_id, None)
+
+    def run(self, lines, chunk_size):
+        chunk = []
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = _record(line_number, line)
+            if record is not None:
+                chunk.append(record)
+            if len(chunk) >= chunk_size:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+        return self.counts
+
+@workspace.route('/import', methods=['POST'])
+@auth_required
+@versioned
+def import_workspace(u=None):
+    if db.engine.dialect.name not in IMPORT_DIALECTS:
+        return {
+            "message": "Import is not available on {}".format(db.engine.dialect.name)
+        }, 501
+
+    importer = Importer(u.id)
+    try:
+        importer.run(request.stream, current_app.config['IMPORT_CHUNK_SIZE'])
+    except InvalidRecord as e:
+        # Chunks before the failing one stay committed, each with its
+        # version bump; report them.
+        return {
+            "message": "Import stopped at line {}: {}".format(e.line, e.message),
+            "data": importer.counts
+        }, 400
+
+    return {
+        "message": "Workspace imported successfully",
+        "data": importer.counts
+    }, 200
@@ -1,14 +1,14 @@
 import os
 from api import create_app, db
 from flask_script import Manager, Shell
-from api.models import User, Project, Task, Label, TaskLabel, ProjectLabel
-from flask_migrate import Migrate
+from api.models import User, Project, Task, Label, TaskLabel, ProjectLabel, UserStats
+from flask_migrate import Migrate, MigrateCommand
 
 
 app = create_app(os.getenv('FLASK_ENV') or 'default')
 
 manager = Manager(app)
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, render_as_batch=True)
 
 @manager.command
 def create_table():
@@ -16,10 +16,243 @@ def create_table():
 	db.create_all()
 	print('Tables created')
 
+@manager.command
+def rebuild_search():
+	"""Create the full-text search index and reindex existing tasks and projects"""
+	from api.search import rebuild_index
+	rebuild_index()
+	print('Search index rebuilt')
+
+@manager.command
+def drain_jobs():
+	"""Run every job that is ready in the foreground, then exit"""
+	from api import job_queue
+	print('Ran {} jobs'.format(job_queue.drain()))
+	stats = job_queue.stats()
+	print('{} queued, {} running, {} failed'.format(stats['queued'], stats['running'], stats['failed']))
+
+@manager.option('-u', '--user', dest='user_id', type=int, default=None, help='only this user')
+def rebuild_stats(user_id=None):
+	"""Recount the dashboard counters of every user (or one) as of today"""
+	from api.stats import rebuild_stats as rebuild
+	user_ids = [user_id] if user_id else [row.id for row in db.session.query(User.id)]
+	for uid in user_ids:
+		rebuild(uid)
+	db.session.commit()
+	print('Rebuilt stats of {} users'.format(len(user_ids)))
+
+@manager.command
+def check_stats():
+	"""Fail if a stored counter row differs from a recount of the tasks table"""
+	from api.stats import COUNTERS, count_stats
+	failed = 0
+	for row in UserStats.query.order_by(UserStats.user_id):
+		expected = count_stats(row.user_id, row.as_of)
+		stored = {name: getattr(row, name) for name in COUNTERS}
+		if stored != expected:
+			failed += 1
+			print('FAIL user {} as of {}: stored {}, counted {}'.format(row.user_id, row.as_of, stored, expected))
+	print('{} rows checked, {} inconsistent'.format(UserStats.query.count(), failed))
+	if failed:
+		raise SystemExit(1)
+
+@manager.command
+def check_ids():
+	"""Fail if a deleted task, project or label id is handed out again; rolls back its rows"""
+	import datetime
+	from api.workspace import allocate_ids
+	values = {
+		Label: {'name': 'check_ids'},
+		Project: {'name': 'check_ids', 'description': '', 'ends': datetime.datetime.utcnow()},
+		Task: {'name': 'check_ids', 'description': ''},
+	}
+	failed = 0
+	try:
+		for model, row in values.items():
+			table = model.__table__
+			ids = []
+			for _ in range(2):
+				ids.append(db.session.execute(table.insert().values(**row)).inserted_primary_key[0])
+				db.session.execute(table.delete().where(table.c.id == ids[-1]))
+			ids.append(allocate_ids(model, 1)[0])
+			ok = ids[0] < ids[1] < ids[2]
+			print('{} {}: created {}, deleted it, created {}, deleted it, import allocates {}'.format(
+				'ok  ' if ok else 'FAIL', table.name, ids[0], ids[1], ids[2]))
+			failed += not ok
+	finally:
+		db.session.rollback()
+	if failed:
+		raise SystemExit(1)
+
+def hot_queries(user_id=1, project_id=1, label_id=1):
+	"""(request path, query builder, indexes it must be answered from) for each hot endpoint query.
+
+	The builders are the endpoints' own, paged as the endpoint pages them,
+	and are called in a request context for the path, so filters and
+	?sort= apply as they do when the endpoint runs.
+	"""
+	import datetime
+	from api.pagination import keyset_query, page_args
+	from api.task import TASK_ORDERS, tasks_query
+	from api.project import PROJECT_ORDERS, PROJECT_TASK_ORDERS, projects_query, project_tasks_query, summary_query
+	from api.label import LABEL_ORDERS, labels_query, labelled
+	from api.sync import changed
+
+	def paged(query, orders, default='id', always=False):
+		return lambda: keyset_query(query(), *page_args(orders, default, always))
+
+	now = datetime.datetime.utcnow()
+	return [
+		('/tasks/all', paged(lambda: tasks_query(user_id), TASK_ORDERS), ['ix_tasks_user_id_id']),
+		('/tasks/all?sort=due&limit=50', paged(lambda: tasks_query(user_id), TASK_ORDERS), ['ix_tasks_user_id_due']),
+		('/tasks/all?completed=false&label={}'.format(label_id), paged(lambda: tasks_query(user_id), TASK_ORDERS), ['ix_tasks_user_id_id']),
+		('/projects/all', paged(lambda: projects_query(user_id), PROJECT_ORDERS), ['ix_projects_user_id_id']),
+		('/projects/summary', paged(lambda: summary_query(user_id, now), PROJECT_ORDERS), ['ix_projects_user_id_id', 'ix_tasks_project_id_due']),
+		('/projects/{}/tasks'.format(project_id), paged(lambda: project_tasks_query(project_id), PROJECT_TASK_ORDERS, 'due', True), ['ix_tasks_project_id_due']),
+		('/labels/all', paged(lambda: labels_query(user_id), LABEL_ORDERS), ['ix_labels_user_id_id']),
+		('/sync', lambda: changed(Task, user_id, None), ['ix_tasks_user_id_updated_at']),
+		('/sync (tasks)', lambda: changed(Task, user_id, now), ['ix_tasks_user_id_updated_at']),
+		('/sync (projects)', lambda: changed(Project, user_id, now), ['ix_projects_user_id_updated_at']),
+		('/sync (labels)', lambda: changed(Label, user_id, now), ['ix_labels_user_id_updated_at']),
+		('/labels/{} DELETE (tasks)'.format(label_id), lambda: labelled(TaskLabel.task_id, label_id), ['ix_tasklabels_label_id']),
+		('/labels/{} DELETE (projects)'.format(label_id), lambda: labelled(ProjectLabel.project_id, label_id), ['ix_projectlabels_label_id']),
+	]
+
+@manager.command
+def check_indexes():
+	"""Fail if a hot endpoint query scans, sorts or uses other indexes than intended"""
+	failed = []
+	for path, build, indexes in hot_queries():
+		with app.test_request_context(path.split(' ')[0]):
+			query = build()
+		statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+		plan = [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + str(statement))]
+		ok = not any(step.startswith('SCAN') or 'TEMP B-TREE' in step for step in plan)
+		ok = ok and all(any('INDEX {} '.format(index) in step + ' ' for step in plan) for index in indexes)
+		print('{} {}: {}'.format('ok  ' if ok else 'FAIL', path, '; '.join(plan)))
+		if not ok:
+			failed.append(path)
+	if failed:
+		raise SystemExit(1)
+
+@manager.option('-n', '--tasks', dest='tasks', type=int, default=10000)
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=5)
+def bench_json(tasks=10000, rounds=5):
+	"""Compare the JSON provider with Flask's stock encoder on a task list payload"""
+	import datetime, json, timeit
+	from flask.json import JSONEncoder
+	now = datetime.datetime(2021, 6, 1, 12, 30)
+	payload = {
+		"message": "Tasks retrieved successfully",
+		"data": [{
+			"id": i, "name": "Task %d" % i, "description": "Description of task %d" % i,
+			"due": now + datetime.timedelta(hours=i), "completed": i % 3 == 0,
+			"creator": {"id": 1, "name": "Bench", "email": "bench@example.com", "username": "bench", "avatar": None, "profile": None},
+			"project": {"id": i % 50, "name": "Project", "description": "", "ends": now},
+			"labels": [{"id": 1, "name": "work", "color": "red"}, {"id": 2, "name": "home", "color": "blue"}]
+		} for i in range(tasks)]
+	}
+	sort_keys = app.config['JSON_SORT_KEYS']
+	encoders = [('stock', lambda: json.dumps(payload, cls=JSONEncoder, sort_keys=sort_keys))]
+	if app.json.fast:
+		encoders.append(('orjson', lambda: app.json.dumps(payload)))
+	fallback = type(app.json)(app)
+	fallback.fast = False
+	encoders.append(('stdlib', lambda: fallback.dumps(payload)))
+	for name, encode in encoders:
+		best = min(timeit.repeat(encode, number=1, repeat=rounds))
+		print('{:8} {:8.1f} ms  {:>9} bytes'.format(name, best * 1000, len(encode())))
+
+@manager.option('-u', '--users', dest='users', type=int, default=10)
+@manager.option('-p', '--projects', dest='projects', type=int, default=5, help='projects per user')
+@manager.option('-t', '--tasks', dest='tasks', type=int, default=20, help='tasks per project')
+@manager.option('-l', '--labels', dest='labels', type=int, default=2, help='labels per task')
+@manager.option('-s', '--seed', dest='random_seed', type=int, default=0)
+def seed(users=10, projects=5, tasks=20, labels=2, random_seed=0):
+	"""Insert a synthetic workload of users, projects, tasks and labels"""
+	import benchmark
+	ids = benchmark.seed(users, projects, tasks, labels, random_seed)
+	print('Seeded {} users, {} projects and {} tasks (password "{}")'.format(
+		len(ids), len(ids) * projects, len(ids) * projects * tasks, benchmark.PASSWORD))
+
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=20)
+@manager.option('-o', '--output', dest='output', default=None, help='write the report as JSON')
+@manager.option('-b', '--baseline', dest='baseline', default=None, help='fail on regressions against this report')
+@manager.option('--tolerance', dest='tolerance', type=float, default=0.25)
+@manager.option('-k', '--only', dest='only', default=None, help='comma separated scenario name filters')
+@manager.option('--reset', dest='reset', action='store_true', default=False, help='recreate the database and seed it first')
+def bench(repeat=20, output=None, baseline=None, tolerance=0.25, only=None, reset=False):
+	"""Benchmark every route through the test client; run against a scratch database"""
+	import benchmark
+	from api.search import rebuild_index
+	if reset:
+		if not (app.debug or app.testing):
+			raise SystemExit('Refusing to reset a production database')
+		db.drop_all()
+		db.create_all()
+		rebuild_index()
+	if not User.query.filter(User.username.like('bench%')).first():
+		benchmark.seed()
+	report = benchmark.run(app, repeat, only.split(',') if only else None)
+	print(benchmark.format_report(report))
+	if output:
+		benchmark.save(report, output)
+	if baseline:
+		base = benchmark.load(baseline)
+		if base['meta'].get('tasks') != report['meta']['tasks']:
+			print('Warning: baseline was taken on a different workload')
+		regressions = benchmark.compare(report, base, tolerance)
+		for regression in regressions:
+			print('REGRESSION ' + regression)
+		if regressions:
+			raise SystemExit(1)
+
+@manager.option('-s', '--sizes', dest='sizes', default='1000,5000,20000', help='comma separated task counts')
+def bench_stream(sizes='1000,5000,20000'):
+	"""Compare peak memory of buffered and streamed task listings as they grow; seeds new users"""
+	import benchmark
+	if not (app.debug or app.testing):
+		raise SystemExit('Refusing to seed a production database')
+	results = benchmark.stream_memory(app, [int(size) for size in sizes.split(',')])
+	print(benchmark.format_stream_memory(results))
+
+@manager.option('-r', '--readers', dest='readers', type=int, default=4)
+@manager.option('-w', '--writers', dest='writers', type=int, default=2)
+@manager.option('-d', '--duration', dest='duration', type=float, default=4.0, help='seconds')
+def bench_concurrency(readers=4, writers=2, duration=4.0):
+	"""Measure mixed read and write throughput from concurrent threads; writes tasks"""
+	import benchmark
+	if not (app.debug or app.testing):
+		raise SystemExit('Refusing to write to a production database')
+	if not User.query.filter(User.username.like('bench%')).first():
+		benchmark.seed()
+	result = benchmark.concurrency(app, readers, writers, duration)
+	print('journal_mode={journal_mode}: {reads_per_s} reads/s, {writes_per_s} writes/s'.format(**result))
+	print('status codes: ' + ', '.join('{} x{}'.format(code, n) for code, n in sorted(result['status'].items())))
+
+@manager.command
+def check_queries():
+	"""Fail if a read route runs more statements for a user with ten times the rows; seeds new users"""
+	import benchmark
+	if not (app.debug or app.testing):
+		raise SystemExit('Refusing to seed a production database')
+	failed = []
+	for path, results in benchmark.query_growth(app).items():
+		statuses = [status for status, _ in results]
+		counts = [count for _, count in results]
+		ok = len(set(counts)) == 1 and all(status == 200 for status in statuses)
+		print('{} {}: {} statements ({})'.format('ok  ' if ok else 'FAIL', path,
+			' -> '.join(str(count) for count in counts), ','.join(str(status) for status in statuses)))
+		if not ok:
+			failed.append(path)
+	if failed:
+		raise SystemExit(1)
+
 def make_shell_context():
 	return dict(app=app, db=db, User=User, Project=Project, Task=Task, Label=Label, TaskLabel=TaskLabel, ProjectLabel=ProjectLabel)
 
 manager.add_command("shell", Shell(make_context=make_shell_context))
+manager.add_command("db", MigrateCommand)
 
 if __name__ == '__main__':
     with app.app_context():
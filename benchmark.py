@@ -0,0 +1,449 @@
+"""Synthetic workload seeding and a route benchmark driven through the test client."""
+
+import base64
+import datetime
+import json
+import platform
+import random
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import event, func
+from werkzeug.security import generate_password_hash
+from api import db
+from api.models import User, Project, Task, Label, TaskLabel, ProjectLabel
+from api.stats import track_tasks
+
+PASSWORD = 'benchmark'
+LABEL_POOL = 10
+COLORS = ['red', 'orange', 'yellow', 'green', 'blue', 'purple']
+
+
+def _next_id(model):
+	return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+def seed(users=10, projects=5, tasks=20, labels=2, seed=0):
+	"""Bulk-insert users, each with projects, tasks per project and labels per task.
+
+	Ids are assigned up front so the whole workload is a handful of
+	executemany statements, and the same arguments always produce the
+	same data. Returns the ids of the seeded users.
+	"""
+	rng = random.Random(seed)
+	pass_hash = generate_password_hash(PASSWORD)
+	now = datetime.datetime(2021, 1, 1)
+	user_id, project_id, task_id, label_id = [_next_id(model) for model in (User, Project, Task, Label)]
+	user_rows, project_rows, task_rows, label_rows, task_links, project_links = [], [], [], [], [], []
+
+	for n in range(users):
+		name = 'bench{}'.format(user_id)
+		user_rows.append({
+			'id': user_id, 'name': name, 'username': name, 'email': name + '@example.com',
+			'pass_hash': pass_hash, 'avatar': 'http://www.gravatar.com/avatar/?d=identicon',
+			'is_admin': n == 0, 'activated': True, 'suspended': False
+		})
+		pool = list(range(label_id, label_id + max(LABEL_POOL, labels)))
+		for lid in pool:
+			label_rows.append({'id': lid, 'name': 'label {}'.format(lid), 'color': rng.choice(COLORS), 'user_id': user_id})
+		label_id += len(pool)
+
+		for _ in range(projects):
+			project_rows.append({
+				'id': project_id, 'name': 'Project {}'.format(project_id), 'description': 'Synthetic project',
+				'user_id': user_id, 'created': now, 'ends': now + datetime.timedelta(days=rng.randint(30, 365)),
+				'completed': False
+			})
+			project_links.append({'project_id': project_id, 'label_id': rng.choice(pool)})
+			for _ in range(tasks):
+				task_rows.append({
+					'id': task_id, 'name': 'Task {}'.format(task_id), 'description': 'Synthetic task number {}'.format(task_id),
+					'user_id': user_id, 'project_id': project_id,
+					'due': now + datetime.timedelta(hours=rng.randint(0, 24 * 365)), 'completed': rng.random() < 0.3
+				})
+				for lid in rng.sample(pool, labels):
+					task_links.append({'task_id': task_id, 'label_id': lid})
+				task_id += 1
+			project_id += 1
+		user_id += 1
+
+	for model, rows in ((User, user_rows), (Label, label_rows), (Project, project_rows), (Task, task_rows),
+			(TaskLabel, task_links), (ProjectLabel, project_links)):
+		if rows:
+			db.session.execute(model.__table__.insert(), rows)
+	db.session.commit()
+	return [row['id'] for row in user_rows]
+
+
+Scenario = namedtuple('Scenario', 'name method path body prepare auth rows')
+
+def scenario(name, method, path, body=None, prepare=None, auth='bearer', rows=None):
+	"""A timed request. prepare(i), if given, runs untimed before each
+	request and returns values for the path and a callable body; a
+	'token' among them replaces the seeded user's. A bytes body is sent
+	as NDJSON. rows(body, response), if given, counts the rows moved, for
+	a throughput figure."""
+	return Scenario(name, method, path, body, prepare, auth, rows)
+
+def _ndjson_rows(data):
+	# Every line but the export header is a row.
+	return max(data.count(b'\n') - 1, 0)
+
+def _create(model, **fields):
+	obj = model(**fields)
+	db.session.add(obj)
+	db.session.commit()
+	return obj
+
+def scenarios(user):
+	task = Task.query.filter_by(user_id=user.id).order_by(Task.id).first()
+	project = Project.query.filter_by(user_id=user.id).order_by(Project.id).first()
+	label = Label.query.filter_by(user_id=user.id).order_by(Label.id).first()
+	labels = [row.id for row in Label.query.filter_by(user_id=user.id).order_by(Label.id).limit(3)]
+	due = '2022-06-01'
+	new_task = {'name': 'Bench task', 'description': 'd', 'creator': user.id, 'project': project.id, 'due': due, 'labels': labels[:2]}
+
+	def fresh(model, **fields):
+		return lambda i: {'id': _create(model, user_id=user.id, **fields).id}
+
+	def fresh_task(i):
+		# Counted as the handlers would, or the deletes drift the stats row.
+		doomed = _create(Task, user_id=user.id, name='Doomed', description='d', project_id=project.id)
+		track_tasks(user.id, [(None, (doomed.due, doomed.completed))])
+		db.session.commit()
+		return {'id': doomed.id}
+
+	def fresh_user(i):
+		name = 'doomed{}x{}'.format(time.time_ns(), i)
+		doomed = _create(User, name=name, username=name, email=name + '@example.com', pass_hash='x', avatar='x')
+		return {'id': doomed.id, 'token': doomed.generate_auth_token().decode()}
+
+	def link(model, **fields):
+		def prepare(i):
+			db.session.merge(model(label_id=label.id, **fields))
+			db.session.commit()
+			return {}
+		return prepare
+
+	def unique(i):
+		return {'name': 'reg{}x{}'.format(time.time_ns(), i)}
+
+	exported = []
+	def export_of_user(i):
+		if not exported:
+			headers = {'Authorization': 'Bearer ' + user.generate_auth_token().decode()}
+			exported.append(current_app.test_client().get('/export', headers=headers).get_data())
+		return fresh_user(i)
+
+	def first_tasks(i):
+		return {'ids': [row.id for row in db.session.query(Task.id).filter_by(user_id=user.id).order_by(Task.id).limit(50)]}
+
+	return [
+		scenario('login', 'POST', '/login', auth='basic'),
+		scenario('register', 'POST', '/register', lambda p: {'email': p['name'] + '@example.com', 'username': p['name'], 'name': p['name'], 'password': PASSWORD}, unique, auth=None),
+		scenario('users.all', 'GET', '/users/all'),
+		scenario('users.get', 'GET', '/users/{}'.format(user.id)),
+		scenario('users.stats', 'GET', '/users/{}/stats'.format(user.id)),
+		scenario('users.update', 'PUT', '/users/{}'.format(user.id), {'email': '', 'name': 'Renamed', 'username': ''}),
+		scenario('users.delete', 'DELETE', '/users/{id}', prepare=fresh_user),
+		scenario('projects.create', 'POST', '/projects', {'name': 'Bench project', 'description': 'd', 'creator': user.id, 'ends': due}),
+		scenario('projects.summary', 'GET', '/projects/summary'),
+		scenario('projects.get', 'GET', '/projects/{}'.format(project.id)),
+		scenario('projects.get?view=summary', 'GET', '/projects/{}?view=summary'.format(project.id)),
+		scenario('projects.get?exclude=tasks', 'GET', '/projects/{}?exclude=tasks'.format(project.id)),
+		scenario('projects.tasks', 'GET', '/projects/{}/tasks'.format(project.id)),
+		scenario('projects.tasks?completed=false', 'GET', '/projects/{}/tasks?completed=false'.format(project.id)),
+		scenario('projects.all', 'GET', '/projects/all'),
+		scenario('projects.all?stream', 'GET', '/projects/all?stream=1'),
+		scenario('projects.update', 'PUT', '/projects/{}'.format(project.id), {'name': 'Renamed', 'ends': due}),
+		scenario('projects.delete', 'DELETE', '/projects/{id}', prepare=fresh(Project, name='Doomed', description='d', ends=datetime.datetime(2022, 1, 1))),
+		scenario('projects.labels.add', 'POST', '/projects/{}/labels'.format(project.id), {'labels': labels}),
+		scenario('projects.labels.replace', 'PUT', '/projects/{}/labels'.format(project.id), {'labels': labels[:2]}),
+		scenario('projects.labels.delete', 'DELETE', '/projects/{}/labels'.format(project.id), {'label': label.id}, link(ProjectLabel, project_id=project.id)),
+		scenario('tasks.create', 'POST', '/tasks', new_task),
+		scenario('tasks.get', 'GET', '/tasks/{}'.format(task.id)),
+		scenario('tasks.all', 'GET', '/tasks/all'),
+		scenario('tasks.all?stream', 'GET', '/tasks/all?stream=1'),
+		scenario('tasks.all?sort=due&limit=50', 'GET', '/tasks/all?sort=due&limit=50'),
+		scenario('tasks.all?completed=false&label', 'GET', '/tasks/all?completed=false&label={}'.format(label.id)),
+		scenario('tasks.update', 'PUT', '/tasks/{}'.format(task.id), {'name': 'Renamed', 'due': due}),
+		scenario('tasks.delete', 'DELETE', '/tasks/{id}', prepare=fresh_task),
+		scenario('tasks.labels.add', 'POST', '/tasks/{}/labels'.format(task.id), {'labels': labels}),
+		scenario('tasks.labels.replace', 'PUT', '/tasks/{}/labels'.format(task.id), {'labels': labels[:2]}),
+		scenario('tasks.labels.delete', 'DELETE', '/tasks/{}/labels'.format(task.id), {'label': label.id}, link(TaskLabel, task_id=task.id)),
+		scenario('tasks.batch.create', 'POST', '/tasks/batch', [new_task] * 50),
+		scenario('tasks.batch.update', 'PATCH', '/tasks/batch', lambda p: [{'id': task_id, 'completed': True} for task_id in p['ids']], first_tasks),
+		scenario('labels.create', 'POST', '/labels', {'name': 'Bench label', 'color': 'red', 'owner': user.id}),
+		scenario('labels.get', 'GET', '/labels/{}'.format(label.id)),
+		scenario('labels.all', 'GET', '/labels/all'),
+		scenario('labels.update', 'PUT', '/labels/{}'.format(label.id), {'name': 'Renamed'}),
+		scenario('labels.delete', 'DELETE', '/labels/{id}', prepare=fresh(Label, name='Doomed', color='red')),
+		scenario('search', 'GET', '/search?q=task'),
+		scenario('sync', 'GET', '/sync'),
+		scenario('export', 'GET', '/export', rows=lambda body, response: _ndjson_rows(response.get_data())),
+		scenario('import', 'POST', '/import', lambda p: exported[0], export_of_user, rows=lambda body, response: _ndjson_rows(body)),
+		scenario('admin.cache', 'GET', '/admin/cache'),
+		scenario('metrics', 'GET', '/metrics', auth=None),
+	]
+
+@contextmanager
+def counting(app):
+	"""Count the statements sent to the primary and every replica; yields
+	a one-item list to read and reset the count through."""
+	queries = [0]
+	def count(*args):
+		queries[0] += 1
+	engines = [db.get_engine(app, bind=bind) for bind in [None] + app.extensions['replica_router'].binds]
+	for engine in engines:
+		event.listen(engine, 'after_cursor_execute', count)
+	try:
+		yield queries
+	finally:
+		for engine in engines:
+			event.remove(engine, 'after_cursor_execute', count)
+
+def _percentile(values, p):
+	ordered = sorted(values)
+	return ordered[max(int(round(p * len(ordered) + 0.5)) - 1, 0)] if ordered else None
+
+def run(app, repeat=20, only=None):
+	"""Time every scenario as the first seeded (admin) user.
+
+	Each scenario runs repeat times for latency and query counts, then
+	once more under tracemalloc for peak memory, which tracing would
+	otherwise inflate the timings of.
+	"""
+	user = User.query.filter(User.username.like('bench%'), User.is_admin == True).order_by(User.id).first()
+	if user is None:
+		raise RuntimeError('No seeded users, run the seed command first')
+	token = user.generate_auth_token().decode()
+	basic = 'Basic ' + base64.b64encode('{}:{}'.format(user.email, PASSWORD).encode()).decode()
+
+	client = app.test_client()
+	results = {}
+	with counting(app) as queries:
+		# Reads first, so they see the seeded workload rather than what the writes added.
+		for s in sorted(scenarios(user), key=lambda s: s.method != 'GET'):
+			if only and not any(name in s.name for name in only):
+				continue
+			latencies, counts, statuses = [], [], set()
+			for i in range(repeat + 1):
+				params = s.prepare(i) if s.prepare else {}
+				body = s.body(params) if callable(s.body) else s.body
+				headers = {}
+				if s.auth == 'basic':
+					headers['Authorization'] = basic
+				elif s.auth == 'bearer':
+					headers['Authorization'] = 'Bearer ' + params.get('token', token)
+				traced = i == repeat
+				if traced:
+					tracemalloc.start()
+				queries[0] = 0
+				started = time.perf_counter()
+				if isinstance(body, bytes):
+					response = client.open(s.path.format(**params), method=s.method, data=body, content_type='application/x-ndjson', headers=headers)
+				else:
+					response = client.open(s.path.format(**params), method=s.method, json=body, headers=headers)
+				response.get_data()
+				elapsed = time.perf_counter() - started
+				if traced:
+					peak = tracemalloc.get_traced_memory()[1]
+					tracemalloc.stop()
+				else:
+					latencies.append(elapsed * 1000)
+					counts.append(queries[0])
+				statuses.add(response.status_code)
+			p50 = _percentile(latencies, 0.5)
+			results[s.name] = {
+				'status': sorted(statuses),
+				'p50_ms': round(p50, 3),
+				'p95_ms': round(_percentile(latencies, 0.95), 3),
+				'queries': _percentile(counts, 0.5),
+				'peak_kb': round(peak / 1024, 1)
+			}
+			if s.rows:
+				results[s.name]['rows_per_s'] = round(s.rows(body, response) / (p50 / 1000)) if p50 else None
+
+	return {
+		'meta': {
+			'created': datetime.datetime.utcnow().isoformat(),
+			'python': platform.python_version(),
+			'database': db.engine.dialect.name,
+			'repeat': repeat,
+			'tasks': Task.query.filter_by(user_id=user.id).count()
+		},
+		'results': results
+	}
+
+def concurrency(app, readers=4, writers=2, seconds=4.0):
+	"""Mixed read and write throughput, one test client per thread.
+
+	Readers page through the first seeded user's tasks and writers create
+	tasks for them, all for the given number of seconds. Returns the rate
+	of each and the status codes seen. Threads share the GIL, so this
+	mostly shows lock and busy-wait behaviour of the database, which is
+	what the SQLite journal mode and pragmas change.
+	"""
+	user = User.query.filter(User.username.like('bench%'), User.is_admin == True).order_by(User.id).first()
+	if user is None:
+		raise RuntimeError('No seeded users, run the seed command first')
+	project = Project.query.filter_by(user_id=user.id).order_by(Project.id).first()
+	headers = {'Authorization': 'Bearer ' + user.generate_auth_token().decode()}
+	body = {'name': 'Concurrent task', 'description': 'd', 'creator': user.id, 'project': project.id, 'due': '2022-06-01'}
+	counts = {'read': 0, 'write': 0}
+	statuses = {}
+	lock = threading.Lock()
+	deadline = time.perf_counter() + seconds
+
+	def work(kind):
+		client = app.test_client()
+		while time.perf_counter() < deadline:
+			if kind == 'read':
+				response = client.get('/tasks/all?limit=50', headers=headers)
+			else:
+				response = client.post('/tasks', json=body, headers=headers)
+			response.get_data()
+			with lock:
+				counts[kind] += 1
+				statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+	threads = [threading.Thread(target=work, args=('read',)) for _ in range(readers)]
+	threads += [threading.Thread(target=work, args=('write',)) for _ in range(writers)]
+	started = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - started
+	return {
+		'journal_mode': db.session.execute('PRAGMA journal_mode').scalar() if db.engine.dialect.name == 'sqlite' else None,
+		'reads_per_s': round(counts['read'] / elapsed, 1),
+		'writes_per_s': round(counts['write'] / elapsed, 1),
+		'status': statuses
+	}
+
+STREAM_PATH = '/tasks/all?fields=id,name,due,completed'
+
+def stream_memory(app, sizes=(1000, 5000, 20000), path=STREAM_PATH):
+	"""Peak traced memory of a buffered and a streamed listing at growing sizes.
+
+	Each size is seeded as a new user with that many tasks. The body is
+	read chunk by chunk and dropped, so the peak is the server's working
+	set rather than the client's copy of the response: flat across sizes
+	when streamed, proportional to the size when buffered.
+	"""
+	client = app.test_client()
+	results = []
+	for size in sizes:
+		user = User.query.get(seed(users=1, projects=1, tasks=size, labels=1)[0])
+		headers = {'Authorization': 'Bearer ' + user.generate_auth_token().decode()}
+		result = {'tasks': size}
+		for name, suffix in (('buffered', ''), ('streamed', '&stream=1')):
+			# Untraced first, so shape compilation and the identity cache
+			# are not charged to the measured request.
+			for traced in (False, True):
+				if traced:
+					tracemalloc.start()
+				response = client.get(path + suffix, headers=headers, buffered=False)
+				size_bytes = 0
+				for chunk in response.response:
+					size_bytes += len(chunk)
+				response.close()
+				if traced:
+					result[name + '_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+					tracemalloc.stop()
+			result[name + '_bytes'] = size_bytes
+		results.append(result)
+	return results
+
+def format_stream_memory(results):
+	lines = ['{:>8} {:>12} {:>12} {:>12}'.format('tasks', 'body KB', 'buffered KB', 'streamed KB')]
+	for r in results:
+		lines.append('{:>8} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+			r['tasks'], r['streamed_bytes'] / 1024, r['buffered_kb'], r['streamed_kb']))
+	return '\n'.join(lines)
+
+# Read routes whose statement count must not depend on how many rows the
+# user has; {task}, {project} and {label} are the user's first of each.
+GROWTH_PATHS = [
+	'/users/{user}', '/users/{user}/stats',
+	'/tasks/all', '/tasks/all?sort=due&limit=50', '/tasks/all?completed=false&label={label}', '/tasks/all?stream=1', '/tasks/{task}',
+	'/projects/all', '/projects/all?stream=1', '/projects/summary', '/projects/{project}', '/projects/{project}?view=summary',
+	'/projects/{project}/tasks', '/labels/all', '/labels/{label}', '/search?q=task', '/sync', '/export',
+]
+
+# (projects, tasks per project) of the small and the large user: ten
+# times the tasks, all within one STREAM_BATCH_SIZE batch.
+GROWTH_SIZES = [(2, 5), (10, 10)]
+
+def query_growth(app, sizes=GROWTH_SIZES, paths=GROWTH_PATHS):
+	"""Statements each read route runs for users seeded at growing sizes.
+
+	Every size is seeded as a new user. Each route is requested once
+	untimed, so the identity cache and first-read stats rows are warm,
+	then counted. Returns {path: [(status, statements) per size]}; a
+	count that grows with the size is an N+1.
+	"""
+	client = app.test_client()
+	results = {path: [] for path in paths}
+	for projects, tasks in sizes:
+		user = User.query.get(seed(users=1, projects=projects, tasks=tasks, labels=2)[0])
+		ids = {
+			'user': user.id,
+			'task': db.session.query(func.min(Task.id)).filter_by(user_id=user.id).scalar(),
+			'project': db.session.query(func.min(Project.id)).filter_by(user_id=user.id).scalar(),
+			'label': db.session.query(func.min(Label.id)).filter_by(user_id=user.id).scalar(),
+		}
+		headers = {'Authorization': 'Bearer ' + user.generate_auth_token().decode()}
+		with counting(app) as queries:
+			for path in paths:
+				for _ in range(2):
+					queries[0] = 0
+					response = client.get(path.format(**ids), headers=headers)
+					response.get_data()
+				results[path].append((response.status_code, queries[0]))
+	return results
+
+# Differences below these floors are noise at this timer resolution.
+LATENCY_FLOOR_MS = 2.0
+MEMORY_FLOOR_KB = 64
+
+def compare(report, baseline, tolerance=0.25):
+	"""List the scenarios that got slower, fatter or chattier than baseline.
+
+	Query counts are deterministic and must not grow at all; median
+	latency and peak memory may grow by tolerance (a fraction). p95 is
+	reported but not gated on, as the tail of a few dozen samples is
+	mostly scheduler and fsync noise. Rows per second follow from the
+	median, so they are gated through it.
+	"""
+	regressions = []
+	for name, base in baseline['results'].items():
+		current = report['results'].get(name)
+		if current is None:
+			continue
+		if current['queries'] > base['queries']:
+			regressions.append('{}: {} queries, was {}'.format(name, current['queries'], base['queries']))
+		if current['p50_ms'] > base['p50_ms'] * (1 + tolerance) and current['p50_ms'] - base['p50_ms'] > LATENCY_FLOOR_MS:
+			regressions.append('{}: p50 {} ms, was {} ms'.format(name, current['p50_ms'], base['p50_ms']))
+		if current['peak_kb'] > base['peak_kb'] * (1 + tolerance) and current['peak_kb'] - base['peak_kb'] > MEMORY_FLOOR_KB:
+			regressions.append('{}: peak {} KB, was {} KB'.format(name, current['peak_kb'], base['peak_kb']))
+	return regressions
+
+def format_report(report):
+	lines = ['{:36} {:>9} {:>9} {:>8} {:>10} {:>10}  {}'.format('scenario', 'p50 ms', 'p95 ms', 'queries', 'peak KB', 'rows/s', 'status')]
+	for name, r in report['results'].items():
+		lines.append('{:36} {:>9.2f} {:>9.2f} {:>8} {:>10.1f} {:>10}  {}'.format(
+			name, r['p50_ms'], r['p95_ms'], r['queries'], r['peak_kb'], r.get('rows_per_s') or '',
+			','.join(str(code) for code in r['status'])))
+	return '\n'.join(lines)
+
+def load(path):
+	with open(path) as f:
+		return json.load(f)
+
+def save(report, path):
+	with open(path, 'w') as f:
+		json.dump(report, f, indent=2, sort_keys=True)
@@ -1,14 +1,73 @@
 #!/usr/bin/python3
 
 import os
+from sqlalchemy.pool import QueuePool
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+def engine_options(uri, pool_size=5, max_overflow=10, pool_recycle=-1, pool_pre_ping=False):
+	"""Pool settings for a database URI; file SQLite gets a real pool too."""
+	if uri in ('sqlite://', 'sqlite:///:memory:'):
+		return {}
+	options = {
+		'pool_size': pool_size,
+		'max_overflow': max_overflow,
+		'pool_recycle': pool_recycle,
+		'pool_pre_ping': pool_pre_ping
+	}
+	if uri.startswith('sqlite'):
+		options['poolclass'] = QueuePool
+		options['connect_args'] = {'check_same_thread': False}
+	return options
+
 class Config():
 	SECRET_KEY = os.environ.get('SECRET_KEY')
 	SQLALCHEMY_COMMIT_ON_TEARDOWN = True
 	SQLALCHEMY_TRACK_MODIFICATIONS = True
 	APP_ADMIN = os.environ.get('ADMIN_MAIL')
+	IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 1024)
+	IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL') or 300)
+	PAGE_SIZE = 50
+	MAX_PAGE_SIZE = 500
+	TASK_BATCH_LIMIT = 200
+	STREAM_BATCH_SIZE = 500
+	IMPORT_CHUNK_SIZE = 1000
+	SYNC_OVERLAP_SECONDS = 5
+	PURGE_ASYNC_THRESHOLD = 10000
+	PURGE_CHUNK_SIZE = 1000
+	JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)
+	JOB_POLL_SECONDS = 1
+	JOB_VISIBILITY_TIMEOUT = 300
+	JOB_MAX_RUNTIME = 3600
+	JOB_MAX_ATTEMPTS = 5
+	JOB_RETRY_DELAY = 5
+	ADMISSION_ENABLED = True
+	ADMISSION_LIMITS = {'auth': 8, 'read': 64, 'write': 32}
+	ADMISSION_EXEMPT = ['admin.get_metrics']
+	ADMISSION_RETRY_AFTER = 1
+	ADMISSION_USER_RATE = float(os.environ.get('ADMISSION_USER_RATE') or 0)
+	ADMISSION_USER_BURST = int(os.environ.get('ADMISSION_USER_BURST') or 30)
+	SQLALCHEMY_REPLICA_URIS = [uri for uri in (os.environ.get('REPLICA_DATABASE_URLS') or '').split(',') if uri]
+	REPLICA_PIN_SECONDS = 5
+	# Pins live in each worker; the cookie carries them to the others.
+	# Set to None for clients that cannot keep cookies, which then only
+	# read their writes from the worker that took them.
+	REPLICA_PIN_COOKIE = 'read_primary'
+	SQLITE_PRAGMAS = {
+		'journal_mode': 'WAL',
+		'synchronous': 'NORMAL',
+		'busy_timeout': 5000,
+		'mmap_size': 268435456,
+		'cache_size': -16000,
+		'foreign_keys': 'ON'
+	}
+	COMPRESS_ENABLED = True
+	COMPRESS_MIN_SIZE = 1024
+	COMPRESS_MIMETYPES = ['application/json', 'application/x-ndjson']
+	COMPRESS_LEVEL = 6
+	COMPRESS_BR_LEVEL = 4
+	SERVER_TIMING = True
+	METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 	@staticmethod
 	def init_app(app):
@@ -17,13 +76,22 @@ class Config():
 class DevelopmentConfig(Config):
 	DEBUG = True
 	SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
+	SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+	COMPRESS_LEVEL = 1
+	COMPRESS_BR_LEVEL = 1
 
 class TestingConfig(Config):
 	TESTING = True
+	JOB_WORKERS = 0
 	SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
+	SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, pool_size=2, max_overflow=5)
 
 class ProductionConfig(Config):
 	SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+	SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, pool_size=10, max_overflow=20, pool_recycle=1800, pool_pre_ping=True)
+	SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS, mmap_size=1073741824, cache_size=-64000)
+	COMPRESS_BR_LEVEL = 5
+	SERVER_TIMING = False
 
 config = {
 	'development': DevelopmentConfig,
@@ -0,0 +1,45 @@
+"""hot lookup indexes
+
+Revision ID: 3f1c2a9d4b10
+Revises: 
+Create Date: 2026-10-18 10:12:41.553120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d4b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_projects_user_id_id', 'projects', ['user_id', 'id']),
+    ('ix_tasks_user_id_id', 'tasks', ['user_id', 'id']),
+    ('ix_tasks_user_id_due', 'tasks', ['user_id', 'due']),
+    ('ix_tasks_project_id', 'tasks', ['project_id']),
+    ('ix_labels_user_id_id', 'labels', ['user_id', 'id']),
+    ('ix_projectlabels_label_id', 'projectlabels', ['label_id', 'project_id']),
+    ('ix_tasklabels_label_id', 'tasklabels', ['label_id', 'task_id']),
+]
+
+
+def _existing(table):
+    inspector = sa.inspect(op.get_bind())
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    # Tables are created by `create_table` (db.create_all), which already
+    # builds these indexes on new databases; only add what is missing.
+    for name, table, columns in INDEXES:
+        if name not in _existing(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        if name in _existing(table):
+            op.drop_index(name, table_name=table)
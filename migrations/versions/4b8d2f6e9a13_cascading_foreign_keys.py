@@ -0,0 +1,64 @@
+"""cascading foreign keys
+
+Revision ID: 4b8d2f6e9a13
+Revises: e2b7f4a91c06
+Create Date: 2026-10-18 17:12:44.630981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from api.search import SEARCHABLE, fts_ddl, fts_rebuild
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8d2f6e9a13'
+down_revision = 'e2b7f4a91c06'
+branch_labels = None
+depends_on = None
+
+FOREIGN_KEYS = {
+    'projects': [('user_id', 'users')],
+    'tasks': [('user_id', 'users'), ('project_id', 'projects')],
+    'labels': [('user_id', 'users')],
+    'projectlabels': [('project_id', 'projects'), ('label_id', 'labels')],
+    'tasklabels': [('task_id', 'tasks'), ('label_id', 'labels')],
+}
+
+# SQLite reflects foreign keys without names; batch mode names them
+# through this convention so they can be dropped.
+NAMING = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def _fk_name(inspector, table, column, referred):
+    for fk in inspector.get_foreign_keys(table):
+        if fk['constrained_columns'] == [column] and fk['name']:
+            return fk['name']
+    return NAMING['fk'] % {'table_name': table, 'column_0_name': column, 'referred_table_name': referred}
+
+
+def _replace_foreign_keys(ondelete):
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table, keys in FOREIGN_KEYS.items():
+        with op.batch_alter_table(table, naming_convention=NAMING) as batch_op:
+            for column, referred in keys:
+                batch_op.drop_constraint(_fk_name(inspector, table, column, referred), type_='foreignkey')
+                batch_op.create_foreign_key(
+                    NAMING['fk'] % {'table_name': table, 'column_0_name': column, 'referred_table_name': referred},
+                    referred, [column], ['id'], ondelete=ondelete
+                )
+    if bind.dialect.name == 'sqlite':
+        # Recreating a table on SQLite drops its triggers, including the
+        # ones keeping the full-text index in sync.
+        for table in SEARCHABLE:
+            for statement in fts_ddl(table) + [fts_rebuild(table)]:
+                op.execute(statement)
+
+
+def upgrade():
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(None)
@@ -0,0 +1,29 @@
+"""collection versions
+
+Revision ID: 8a4e7c21d5f3
+Revises: 3f1c2a9d4b10
+Create Date: 2026-10-18 11:02:17.904316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e7c21d5f3'
+down_revision = '3f1c2a9d4b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('collection_versions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('collection_versions')
@@ -0,0 +1,37 @@
+"""project task order
+
+Revision ID: a7e1c3f5d820
+Revises: 9c3e5a7b1d24
+Create Date: 2026-10-18 19:12:40.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e1c3f5d820'
+down_revision = '9c3e5a7b1d24'
+branch_labels = None
+depends_on = None
+
+
+def _existing(table):
+    inspector = sa.inspect(op.get_bind())
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    # (project_id, due, id) serves the ordered /projects/<id>/tasks pages
+    # and, as a prefix, every lookup the project_id index did.
+    if 'ix_tasks_project_id_due' not in _existing('tasks'):
+        op.create_index('ix_tasks_project_id_due', 'tasks', ['project_id', 'due', 'id'])
+    if 'ix_tasks_project_id' in _existing('tasks'):
+        op.drop_index('ix_tasks_project_id', table_name='tasks')
+
+
+def downgrade():
+    if 'ix_tasks_project_id' not in _existing('tasks'):
+        op.create_index('ix_tasks_project_id', 'tasks', ['project_id'])
+    if 'ix_tasks_project_id_due' in _existing('tasks'):
+        op.drop_index('ix_tasks_project_id_due', table_name='tasks')
@@ -0,0 +1,35 @@
+"""full text search
+
+Revision ID: c5d9e0f17a42
+Revises: 8a4e7c21d5f3
+Create Date: 2026-10-18 12:31:05.118734
+
+"""
+from alembic import op
+
+from api.search import SEARCHABLE, fts_ddl, fts_rebuild
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d9e0f17a42'
+down_revision = '8a4e7c21d5f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in SEARCHABLE:
+        for statement in fts_ddl(table) + [fts_rebuild(table)]:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in SEARCHABLE:
+        index = table + '_fts'
+        for suffix in ('_ai', '_ad', '_au'):
+            op.execute('DROP TRIGGER IF EXISTS ' + index + suffix)
+        op.execute('DROP TABLE IF EXISTS ' + index)
@@ -0,0 +1,35 @@
+"""user stats
+
+Revision ID: d4a6b8c0e215
+Revises: a7e1c3f5d820
+Create Date: 2026-10-18 20:26:08.530917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a6b8c0e215'
+down_revision = 'a7e1c3f5d820'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are created on first read, so existing users need no backfill.
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.Column('overdue', sa.Integer(), nullable=False),
+    sa.Column('due_today', sa.Integer(), nullable=False),
+    sa.Column('due_week', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='fk_user_stats_user_id_users', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_stats')
@@ -0,0 +1,43 @@
+"""delta sync
+
+Revision ID: e2b7f4a91c06
+Revises: c5d9e0f17a42
+Create Date: 2026-10-18 15:41:09.227310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7f4a91c06'
+down_revision = 'c5d9e0f17a42'
+branch_labels = None
+depends_on = None
+
+TABLES = ('projects', 'tasks', 'labels')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE {} SET updated_at = CURRENT_TIMESTAMP'.format(table))
+        op.create_index('ix_{}_user_id_updated_at'.format(table), table, ['user_id', 'updated_at'], unique=False)
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('object_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_user_id_id', 'tombstones', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tombstones_user_id_id', table_name='tombstones')
+    op.drop_table('tombstones')
+    for table in TABLES:
+        op.drop_index('ix_{}_user_id_updated_at'.format(table), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
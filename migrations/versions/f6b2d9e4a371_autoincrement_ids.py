@@ -0,0 +1,57 @@
+"""autoincrement ids
+
+Revision ID: f6b2d9e4a371
+Revises: d4a6b8c0e215
+Create Date: 2026-10-18 22:05:37.214590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from api.search import SEARCHABLE, fts_ddl
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b2d9e4a371'
+down_revision = 'd4a6b8c0e215'
+branch_labels = None
+depends_on = None
+
+# Tables whose deleted ids are sent to sync clients as tombstones, with
+# the kind they are recorded under.
+TOMBSTONED = {'tasks': 'task', 'projects': 'project', 'labels': 'label'}
+
+
+def _recreate(autoincrement):
+    # Without AUTOINCREMENT SQLite hands a new row the id of the highest
+    # deleted one, which a sync client then sees both created and deleted.
+    for table in TOMBSTONED:
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': autoincrement}):
+            pass
+    # Recreating a table drops its triggers, including the full-text ones.
+    for table in SEARCHABLE:
+        for statement in fts_ddl(table):
+            op.execute(statement)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _recreate(True)
+    # Ids deleted before this migration are known only from tombstones;
+    # start the sequence past them too.
+    for table, kind in TOMBSTONED.items():
+        op.execute(sa.text('DELETE FROM sqlite_sequence WHERE name = :table').bindparams(table=table))
+        op.execute(sa.text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT :table, max("
+            "coalesce((SELECT max(id) FROM {table}), 0), "
+            "coalesce((SELECT max(object_id) FROM tombstones WHERE kind = :kind), 0))".format(table=table)
+        ).bindparams(table=table, kind=kind))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _recreate(False)
+    for table in TOMBSTONED:
+        op.execute(sa.text('DELETE FROM sqlite_sequence WHERE name = :table').bindparams(table=table))